@@ -1,11 +1,305 @@
-from functools import total_ordering
+from functools import total_ordering, lru_cache
+from bisect import bisect_right
+from collections.abc import MutableMapping, KeysView, ValuesView, ItemsView, Sequence
+from enum import IntEnum
+import atexit
 import datetime
+import os
+import re
+import time as time_module
+import struct
+import tempfile
+import weakref
+from importlib import metadata
 
 import numpy as np
 import pandas as pd
-from sortedcontainers import SortedDict
 import jpholiday
 
+try:
+    from numba import njit, prange
+except ImportError as e:
+    # numbaがインストールされていないとき
+    _HAS_NUMBA = False
+else:
+    _HAS_NUMBA = True
+
+# 無限大・負の無限大を表すint64の番兵
+_INT64_MIN = np.iinfo(np.int64).min
+_INT64_MAX = np.iinfo(np.int64).max
+
+def _time_to_i8(t, inf_value):
+    """時刻をエポックからのナノ秒(int)に変換する。Noneのときはinf_valueを返す"""
+    if t is None:
+        return inf_value
+    return _to_i8(t)
+
+def _to_datetime64_ns(t):
+    """
+    時刻をdatetime64[ns]に揃える。
+    単位の異なるdatetime64同士の比較は遅いので、内部では常にナノ秒単位で扱う。
+    
+    Raises
+    ------
+    pandas.errors.OutOfBoundsDatetime
+        datetime64[ns]で表せない時刻のとき
+    """
+    return np.datetime64(_to_i8(t), 'ns')
+
+# datetime64の各単位の1単位あたりのナノ秒数
+_NS_PER_UNIT = {
+    'W': 7 * 86400 * 10**9, 'D': 86400 * 10**9, 'h': 3600 * 10**9,
+    'm': 60 * 10**9, 's': 10**9, 'ms': 10**6, 'us': 10**3, 'ns': 1,
+}
+# 年・月は長さが一定でないので、datetime64[ns]で表せる範囲を日の範囲から求めておく
+# (numpyのdatetime64[ns]から粗い単位への変換は最小値付近で正しく丸められないので、整数演算で求める)
+_YM_BOUNDS = {}
+for _unit in ('Y', 'M'):
+    _lo_d = np.datetime64(-((-(_INT64_MIN + 1)) // _NS_PER_UNIT['D']), 'D')
+    _hi_d = np.datetime64(_INT64_MAX // _NS_PER_UNIT['D'], 'D')
+    _lo = _lo_d.astype(f'datetime64[{_unit}]')
+    if _lo.astype('datetime64[D]') < _lo_d:
+        _lo += 1
+    _YM_BOUNDS[_unit] = (int(_lo.astype(np.int64)), int(_hi_d.astype(f'datetime64[{_unit}]').astype(np.int64)))
+del _unit, _lo_d, _hi_d, _lo
+
+# datetime64のスカラーからint64の値を取り出す(.view('i8')より速い)
+_unpack_i8 = struct.Struct('q').unpack
+
+# datetime64の(単位, 数)ごとの(乗数, 除数, 最小値, 最大値)。値*乗数/除数がナノ秒となる(_unit_info参照)
+_UNIT_INFO = {}
+
+def _unit_info(unit_count):
+    """
+    datetime64の(単位, 数)について、ナノ秒への変換に使う(乗数, 除数, 最小値, 最大値)を返す。
+    最小値・最大値はdatetime64[ns]で表せる範囲を元の単位の整数値で表したもの。
+    年・月は長さが一定でないので、乗数をNoneとする。
+    """
+    unit, count = unit_count
+    if unit in _YM_BOUNDS:
+        lo, hi = _YM_BOUNDS[unit]
+        info = (None, 1, -(-lo // count), hi // count)
+    elif unit in ('ps', 'fs', 'as'):
+        # ナノ秒より細かい単位は、int64の範囲の値ならすべてdatetime64[ns]の範囲に収まる
+        info = (count, 1000 ** (('ps', 'fs', 'as').index(unit) + 1), _INT64_MIN + 1, _INT64_MAX)
+    else:
+        mul = _NS_PER_UNIT[unit] * count
+        info = (mul, 1, -((-(_INT64_MIN + 1)) // mul), _INT64_MAX // mul)
+    _UNIT_INFO[unit_count] = info
+    return info
+
+def _to_i8(t):
+    """
+    時刻をエポックからのナノ秒(int)に変換する。NaTは_INT64_MINとなる。
+    
+    datetime64[ns]で表せるのはおよそ1677年から2262年までで、
+    np.datetime64(t, 'ns')はその範囲外の時刻を黙って折り返すので、
+    元の単位のまま範囲を確認してから変換する。
+    
+    Raises
+    ------
+    pandas.errors.OutOfBoundsDatetime
+        datetime64[ns]で表せない時刻のとき
+    ValueError
+        ナノ秒より細かい時刻が、ナノ秒単位では表せないとき
+    """
+    if isinstance(t, (int, np.integer)):
+        # 整数はエポックからのナノ秒とみなす
+        return int(t)
+    if isinstance(t, np.datetime64):
+        t64 = t
+    elif isinstance(t, pd.Timestamp) or getattr(t, 'tzinfo', None) is not None:
+        # pd.Timestampはナノ秒を保持したまま、tz-awareな時刻はUTCに直して変換する
+        return pd.Timestamp(t).as_unit('ns').value
+    else:
+        t64 = np.datetime64(t)
+    v = _unpack_i8(t64)[0]
+    if v == _INT64_MIN:
+        # NaT
+        return v
+    # dtypeのハッシュは遅いので、(単位, 数)で引く
+    unit_count = np.datetime_data(t64.dtype)
+    info = _UNIT_INFO.get(unit_count)
+    if info is None:
+        info = _unit_info(unit_count)
+    mul, div, lo, hi = info
+    if not lo <= v <= hi:
+        raise pd.errors.OutOfBoundsDatetime(f"{t} is out of bounds for datetime64[ns].")
+    if mul is None:
+        return int(t64.astype('datetime64[ns]').view(np.int64))
+    n, r = divmod(v * mul, div)
+    if r:
+        raise ValueError(f"{t} cannot be represented in datetime64[ns].")
+    return n
+
+def _to_i8_array(times):
+    """
+    時刻の配列をエポックからのナノ秒(int64)の配列に変換する。
+    _to_datetime64_nsと同じく、datetime64[ns]で表せない時刻があれば
+    pandas.errors.OutOfBoundsDatetimeを送出する。
+    """
+    a = np.asarray(times)
+    if a.dtype == np.dtype('datetime64[ns]'):
+        return a.view('i8')
+    # np.asarray(..., dtype='datetime64[ns]')は範囲外の時刻を黙って折り返すので、pandasの変換を通す
+    return pd.DatetimeIndex(a.ravel()).as_unit('ns').asi8.reshape(a.shape)
+
+def _i8_to_time(n):
+    """エポックからのナノ秒(int)を時刻に変換する。番兵のときはNoneを返す"""
+    if n == _INT64_MIN or n == _INT64_MAX:
+        return None
+    return np.datetime64(n, 'ns')
+
+def _time_to_str(t):
+    """時刻を必要な桁数だけの文字列にする"""
+    if t is None:
+        return str(t)
+    return np.datetime_as_string(t, unit='auto')
+
+def _sweep_i8(a_starts, a_ends, b_starts, b_ends, op):
+    """
+    Sweep the boundaries of two sets of disjoint ranges and return the ranges
+    where op(active_a, active_b) holds.
+
+    Parameters
+    ----------
+    a_starts, a_ends, b_starts, b_ends : np.ndarray of int64
+        Sorted and disjoint ranges of each set.
+    op : callable
+        A function combining two boolean arrays (e.g. np.logical_and).
+
+    Returns
+    -------
+    tuple of np.ndarray of int64
+        Starting and ending points of the resulting ranges.
+    """
+    n_a = len(a_starts)
+    n_b = len(b_starts)
+    if n_a + n_b == 0:
+        return a_starts, a_ends
+    times = np.concatenate((a_starts, a_ends, b_starts, b_ends))
+    # 始点で+1、終点で-1となるマーカー
+    delta_a = np.concatenate((np.ones(n_a, np.int64), -np.ones(n_a, np.int64), np.zeros(2 * n_b, np.int64)))
+    delta_b = np.concatenate((np.zeros(2 * n_a, np.int64), np.ones(n_b, np.int64), -np.ones(n_b, np.int64)))
+    
+    order = np.argsort(times, kind='stable')
+    times = times[order]
+    active_a = np.cumsum(delta_a[order]) > 0
+    active_b = np.cumsum(delta_b[order]) > 0
+    
+    # 同時刻のイベントはまとめて、すべて処理し終えた後の状態を採用する
+    # (is_active[i]は区間[times[i], times[i+1])での状態を表す)
+    is_last = np.append(times[1:] != times[:-1], True)
+    times = times[is_last]
+    is_active = op(active_a[is_last], active_b[is_last])
+    
+    # 状態が切り替わる時刻が区間の境界となる
+    # (最後のイベントの後はすべての区間が終わっているので、始点と終点の数は一致する)
+    edges = np.diff(is_active.astype(np.int8), prepend=0)
+    return times[edges == 1], times[edges == -1]
+
+def _consolidate_i8(starts, ends):
+    """
+    Merge overlapping or continuous ranges into sorted disjoint ranges.
+
+    Parameters
+    ----------
+    starts, ends : np.ndarray of int64
+        Ranges in arbitrary order. Ranges with zero duration are dropped.
+
+    Returns
+    -------
+    tuple of np.ndarray of int64
+        Starting and ending points of the consolidated ranges.
+    """
+    # 長さ0の区間を除く
+    is_valid = starts < ends
+    starts = starts[is_valid]
+    ends = ends[is_valid]
+    if len(starts) == 0:
+        return starts, ends
+    
+    # 始点でソート
+    order = np.argsort(starts, kind='stable')
+    starts = starts[order]
+    ends = ends[order]
+    
+    # それまでの終点の最大値より後に始まる区間から新しいグループとする
+    # (終点と始点が一致する連続した区間は同じグループになる)
+    cummax_ends = np.maximum.accumulate(ends)
+    is_gap = starts[1:] > cummax_ends[:-1]
+    boundary_idx = np.flatnonzero(np.concatenate(([True], is_gap)))
+    
+    # グループごとにまとめる
+    return np.minimum.reduceat(starts, boundary_idx), np.maximum.reduceat(ends, boundary_idx)
+
+def _subtract_i8(a_starts, a_ends, b_starts, b_ends):
+    """Subtract sorted disjoint ranges b from sorted disjoint ranges a."""
+    return _sweep_i8(
+        a_starts, a_ends, b_starts, b_ends,
+        lambda active_a, active_b: active_a & ~active_b,
+    )
+
+if _HAS_NUMBA:
+    # numbaが使えるときは、逐次的な処理をコンパイルしたループで置き換える
+    
+    @njit(cache=True)
+    def _consolidate_i8(starts, ends):
+        order = np.argsort(starts, kind='mergesort')
+        out_starts = np.empty(len(starts), np.int64)
+        out_ends = np.empty(len(starts), np.int64)
+        k = -1
+        for i in order:
+            s = starts[i]
+            e = ends[i]
+            if s >= e:
+                continue
+            if k >= 0 and s <= out_ends[k]:
+                # 直前の区間と重なるか連続しているときは結合する
+                if e > out_ends[k]:
+                    out_ends[k] = e
+            else:
+                k += 1
+                out_starts[k] = s
+                out_ends[k] = e
+        return out_starts[:k + 1], out_ends[:k + 1]
+    
+    @njit(cache=True)
+    def _subtract_i8(a_starts, a_ends, b_starts, b_ends):
+        n_b = len(b_starts)
+        out_starts = np.empty(len(a_starts) + n_b, np.int64)
+        out_ends = np.empty(len(a_starts) + n_b, np.int64)
+        k = 0
+        j = 0
+        for i in range(len(a_starts)):
+            s = a_starts[i]
+            e = a_ends[i]
+            # aの区間より前に終わるbの区間は以降も関係しないので飛ばす
+            while j < n_b and b_ends[j] <= s:
+                j += 1
+            
+            # aの区間と重なるbの区間を順に取り除く
+            m = j
+            while m < n_b and b_starts[m] < e and s < e:
+                if b_starts[m] > s:
+                    out_starts[k] = s
+                    out_ends[k] = b_starts[m]
+                    k += 1
+                s = max(s, b_ends[m])
+                m += 1
+            
+            if s < e:
+                out_starts[k] = s
+                out_ends[k] = e
+                k += 1
+        return out_starts[:k], out_ends[:k]
+
+def _range_to_i8_arrays(r):
+    """TimeRangeを、区間の集合と同じ形式のint64配列の組にする"""
+    if r.is_duration_zero:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    return np.array([r._s_i8], np.int64), np.array([r._e_i8], np.int64)
+
 @total_ordering
 class TimewithInf:
     """
@@ -33,9 +327,17 @@ class TimewithInf:
     __lt__(other)
         Compare this object with another TimewithInf object for ordering.
     """
-    def __init__(self, value):
+    __slots__ = ('is_inf', 'is_ninf', 'value', '_pair_i8', '__weakref__')
+    
+    # 同じ値のオブジェクトを使い回すためのキャッシュ (キーは_pair_i8)
+    _cache = weakref.WeakValueDictionary()
+    
+    def __new__(cls, value):
         """
-        Initialize the TimewithInf object.
+        Create the TimewithInf object.
+        
+        Objects are immutable, so an existing object with the same value is
+        returned if there is one.
         
         Parameters
         ----------
@@ -43,19 +345,27 @@ class TimewithInf:
             The value to be stored in the object. 
             Could be a datetime, np.inf, or -np.inf.
         """
-        self.is_inf = False
-        self.is_ninf = False
-        
         if isinstance(value, float):
             assert value in [np.inf, -np.inf]
-            if value == np.inf:
-                self.is_inf = True
-            elif value == (-np.inf):
-                self.is_ninf = True
-                
-            self.value = value
+            pair_i8 = (1, 0) if value == np.inf else (-1, 0)
         else:
-            self.value = np.datetime64(value)
+            value = _to_datetime64_ns(value)
+            pair_i8 = (0, int(value.view('i8')))
+            
+        self = cls._cache.get(pair_i8)
+        if self is not None:
+            return self
+        
+        self = super().__new__(cls)
+        self.is_inf = pair_i8[0] == 1
+        self.is_ninf = pair_i8[0] == -1
+        self.value = value
+        self._pair_i8 = pair_i8
+        cls._cache[pair_i8] = self
+        return self
+    
+    def __getnewargs__(self):
+        return (self.value,)
             
     def time_or_none(self):
         """
@@ -77,34 +387,28 @@ class TimewithInf:
     def __repr__(self):
         return str(self)
         
+    def _as_pair_i8(self):
+        """
+        比較用のキー (種類, ナノ秒)を返す。種類は -inf: -1, 有限: 0, inf: 1
+        """
+        return self._pair_i8
+    
+    def _lt_fast(self, other):
+        """return self < other (otherもTimewithInfであることを前提とする)"""
+        return self._pair_i8 < other._pair_i8
+        
     def __eq__(self, other):
         if not isinstance(other, TimewithInf):
             other = TimewithInf(other)
             
-        if type(self.value) == type(other.value):
-            return self.value == other.value
-        else:
-            return False
+        return self._pair_i8 == other._pair_i8
         
     def __lt__(self, other):
         """return self < other"""
         if not isinstance(other, TimewithInf):
             other = TimewithInf(other)
             
-        if self.is_inf:
-            return False # (inf < other) ... False 
-        elif self.is_ninf:
-            if other.is_ninf:
-                return False # (-inf < -inf) ... False
-            else:
-                return True # (-inf < other) ... True
-        else:
-            if other.is_ninf:
-                return False # (self < -inf) ... False
-            elif other.is_inf:
-                return True # (self < inf) ... True
-            else:
-                return self.value < other.value
+        return self._lt_fast(other)
             
 class TimeRange:
     """
@@ -154,6 +458,11 @@ class TimeRange:
     __xor__(other)
         Get the symmetric difference of this time range with another using the ^ operator.
     """
+    __slots__ = (
+        '_s_i8', '_e_i8', 'is_duration_zero', 'is_duration_inf', 'ranges',
+        '_start_obj', '_end_obj',
+    )
+    
     def __init__(self, start=None, end=None):
 
         """
@@ -169,23 +478,48 @@ class TimeRange:
             into the future.
         """
         if isinstance(start, TimewithInf):
-            self.start = start.time_or_none()
-            self._start_obj = start
-        else:
-            self.start = start and np.datetime64(start)
-            self._start_obj = TimewithInf(start or (-np.inf))
-            
+            start = start.time_or_none()
         if isinstance(end, TimewithInf):
-            self.end = end.time_or_none()
-            self._end_obj = end
-        else:
-            self.end = end and np.datetime64(end)
-            self._end_obj = TimewithInf(end or np.inf)
-        
-        self.is_duration_zero = self.start and self.end and (self.start >= self.end)
-        self.is_duration_inf = (self.start is None) or (self.end is None)
+            end = end.time_or_none()
         
+        # 内部ではエポックからのナノ秒(int)だけを持ち、比較もintで行う
+        self._set_i8(
+            _time_to_i8(start, _INT64_MIN),
+            _time_to_i8(end, _INT64_MAX),
+        )
+    
+    @classmethod
+    def _from_i8(cls, s_i8, e_i8):
+        """Create a TimeRange object directly from nanoseconds since epoch."""
+        obj = cls.__new__(cls)
+        obj._set_i8(s_i8, e_i8)
+        return obj
+    
+    def _set_i8(self, s_i8, e_i8):
+        self._s_i8 = s_i8
+        self._e_i8 = e_i8
+        self.is_duration_zero = s_i8 >= e_i8
+        self.is_duration_inf = (s_i8 == _INT64_MIN) or (e_i8 == _INT64_MAX)
         self.ranges = [self]
+    
+    # 境界のnp.datetime64は、参照されたときにintから作る
+    @property
+    def start(self):
+        return _i8_to_time(self._s_i8)
+    
+    @property
+    def end(self):
+        return _i8_to_time(self._e_i8)
+        
+    def __getattr__(self, name):
+        # TimewithInfの境界は互換性のために残しており、参照されたときに作る
+        if name == '_start_obj':
+            self._start_obj = TimewithInf(-np.inf if self.start is None else self.start)
+            return self._start_obj
+        elif name == '_end_obj':
+            self._end_obj = TimewithInf(np.inf if self.end is None else self.end)
+            return self._end_obj
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
         
     @staticmethod
     def zero_range():
@@ -201,14 +535,14 @@ class TimeRange:
         if self.is_duration_zero:
             return "TimeRange()"
         else:
-            return f"TimeRange('{self.start}', '{self.end}')"
+            return f"TimeRange('{_time_to_str(self.start)}', '{_time_to_str(self.end)}')"
 
     def __repr__(self):
         return self.__str__()
     
     def copy(self):
         """Create a copy of this time range."""
-        return TimeRange(self.start, self.end)
+        return TimeRange._from_i8(self._s_i8, self._e_i8)
 
     def duration(self):
         """Get the duration of this time range."""
@@ -221,34 +555,44 @@ class TimeRange:
         
     def contains(self, t):
         """Check whether a time value is contained within this time range."""
-        return self._start_obj <= t < self._end_obj
+        if isinstance(t, TimewithInf):
+            t = t.time_or_none()
+        return self._s_i8 <= _time_to_i8(t, _INT64_MIN) < self._e_i8
 
     def overlaps(self, other):
         """Check whether this time range overlaps with another time range."""
         if self.is_duration_zero or other.is_duration_zero:
             return False
         else:
-            # 補足: 2項目がself.contains(other.end)だと、self.start == other.endのとき、
-            # 半開区間同士ゆえに重なっていないのにTrueになってしまう
-            return self.contains(other.start) or other.contains(self.start)
+            # 補足: 半開区間同士なので、self.start == other.endのときは重なっていない
+            return (self._s_i8 < other._e_i8) and (other._s_i8 < self._e_i8)
+    
+    def _is_whole(self):
+        """Check whether this time range covers the whole time axis."""
+        return self._s_i8 == _INT64_MIN and self._e_i8 == _INT64_MAX
     
     def continuous(self, other):
         """Check whether this time range is continuous with another time range."""
-        return (self._start_obj == other._end_obj) or (self._end_obj == other._start_obj)
+        return (self._s_i8 == other._e_i8) or (self._e_i8 == other._s_i8)
 
     def intersection(self, other):
         """Get the intersection of this time range with another."""
-        new_start_obj = max(self._start_obj, other._start_obj)
-        new_end_obj = min(self._end_obj, other._end_obj)
-        return TimeRange(new_start_obj, new_end_obj)
+        # 一方が空、またはもう一方が全区間のときは計算するまでもない
+        if self.is_duration_zero or other._is_whole():
+            return self
+        if other.is_duration_zero or self._is_whole():
+            return other
+        return TimeRange._from_i8(max(self._s_i8, other._s_i8), min(self._e_i8, other._e_i8))
     
     def union(self, other):
         """Get the union of this time range with another."""
+        if other.is_duration_zero or self._is_whole():
+            return self
+        if self.is_duration_zero or other._is_whole():
+            return other
         if self.overlaps(other) or self.continuous(other):
             # 合計が一つの連続した区間になるとき
-            new_start_obj = min(self._start_obj, other._start_obj)
-            new_end_obj = max(self._end_obj, other._end_obj)
-            return TimeRange(new_start_obj, new_end_obj)
+            return TimeRange._from_i8(min(self._s_i8, other._s_i8), max(self._e_i8, other._e_i8))
         else:
             # 2つの区間が離れているとき
             return DisjointTimeRanges([self, other])
@@ -312,12 +656,14 @@ class TimeRange:
     
     def __sub__(self, other):
         if isinstance(other, TimeRange):
+            if other.is_duration_zero or self.is_duration_zero:
+                return self
             if intersection := self.intersection(other):
                 ranges = []
-                if self._start_obj < intersection._start_obj:
-                    ranges.append(TimeRange(self.start, intersection.start))
-                if self._end_obj > intersection._end_obj:
-                    ranges.append(TimeRange(intersection.end, self.end))
+                if self._s_i8 < intersection._s_i8:
+                    ranges.append(TimeRange._from_i8(self._s_i8, intersection._s_i8))
+                if self._e_i8 > intersection._e_i8:
+                    ranges.append(TimeRange._from_i8(intersection._e_i8, self._e_i8))
                 return DisjointTimeRanges(ranges)
             else:
                 return self
@@ -345,10 +691,12 @@ class TimeRange:
     
     def __eq__(self, other):
         if isinstance(other, TimeRange):
-            return (self.start == other.start) and (self.end == other.end)
+            return (self._s_i8 == other._s_i8) and (self._e_i8 == other._e_i8)
         return NotImplemented
     
 class DisjointTimeRanges:
+    __slots__ = ('_starts', '_ends', '_ranges', '_n_ranges')
+    
     def __init__(self, ranges=None):
         """
         Initializes the DisjointTimeRanges object to manage a set of disjoint time ranges.
@@ -363,14 +711,52 @@ class DisjointTimeRanges:
         ----------
         ranges : list of TimeRange objects
             Stores the list of disjoint time ranges managed by this object.
+            Materialized lazily from the internal int64 arrays.
+        _starts : np.ndarray of int64
+            Starting points of the time ranges in nanoseconds since epoch.
+            -inf is represented by the minimum value of int64.
+        _ends : np.ndarray of int64
+            Ending points of the time ranges in nanoseconds since epoch.
+            inf is represented by the maximum value of int64.
         """
         if ranges is None:
             # rangesの指定がないとき
             # 全区間を表すオブジェクトとする
-            self.ranges = [TimeRange()]
+            ranges = [TimeRange()]
         else:
-            self.ranges = ranges
+            # 長さ0の区間は最初に除いておく
+            ranges = [r for r in ranges if not r.is_duration_zero]
+        self._starts = np.array([r._s_i8 for r in ranges], dtype=np.int64)
+        self._ends = np.array([r._e_i8 for r in ranges], dtype=np.int64)
+        self._ranges = None
         self._consolidate_ranges()
+        
+    @classmethod
+    def _from_i8(cls, starts, ends, consolidated=False):
+        """Create a DisjointTimeRanges object directly from int64 arrays."""
+        obj = cls.__new__(cls)
+        obj._starts = starts
+        obj._ends = ends
+        obj._ranges = None
+        if consolidated:
+            obj._n_ranges = len(starts)
+        else:
+            obj._consolidate_ranges()
+        return obj
+    
+    def _get_ranges(self):
+        """TimeRangeのリストを、参照されたときに作って使い回す"""
+        if self._ranges is None:
+            self._ranges = [
+                TimeRange._from_i8(s, e)
+                for s, e in zip(self._starts.tolist(), self._ends.tolist())
+            ]
+        return self._ranges
+    
+    @property
+    def ranges(self):
+        # 使い回しているリストを外から変更されないよう、コピーを返す
+        return list(self._get_ranges())
     
     def copy(self):
         """
@@ -381,7 +767,7 @@ class DisjointTimeRanges:
         DisjointTimeRanges
             A new DisjointTimeRanges object that is a copy of the current object.
         """
-        return DisjointTimeRanges(ranges=self.ranges)
+        return DisjointTimeRanges._from_i8(self._starts.copy(), self._ends.copy(), consolidated=True)
     
     @staticmethod
     def zero_range():
@@ -396,45 +782,74 @@ class DisjointTimeRanges:
         return DisjointTimeRanges(ranges=[])
     
     def _consolidate_ranges(self):
-        if len(self.ranges) == 0:
-            return
-        
-        # (start, end)の辞書順でソート
-        self.ranges.sort(key=lambda r: (r._start_obj, r._end_obj))
-        
-        # 重なる範囲をグループ化
-        parent_idxs = []
-        for i in range(1, len(self.ranges)):
-            r0 = self.ranges[i - 1]
-            r1 = self.ranges[i]
-            if r0.overlaps(r1) or r0.continuous(r1):
-                self.ranges[i] |= self.ranges[i - 1]
-            else:
-                parent_idxs.append(i - 1)
-        parent_idxs.append(len(self.ranges) - 1)
-                
-        # 範囲リストを更新
-        self.ranges = [self.ranges[i] for i in parent_idxs if self.ranges[i]]
-        self.ranges.sort(key=lambda r: (r._start_obj, r._end_obj))  # 再度ソート
+        self._starts, self._ends = _consolidate_i8(self._starts, self._ends)
+        self._ranges = None
+        self._n_ranges = len(self._starts)
     
     def __repr__(self):
-        return f"DisjointTimeRanges({repr(self.ranges)})"
+        return f"DisjointTimeRanges({repr(self._get_ranges())})"
     
     def duration(self):
         """Get the sum of durations of the time ranges."""
-        return sum([r.duration() for r in self.ranges])
+        if self._n_ranges == 0:
+            return 0
+        elif self._starts[0] == _INT64_MIN or self._ends[-1] == _INT64_MAX:
+            return np.inf
+        else:
+            return np.timedelta64(int((self._ends - self._starts).sum()), 'ns')
     
     def contains(self, t):
-        """Checks if a specific time is contained within the time ranges."""
-        return any(r.contains(t) for r in self.ranges) # any(generator)は短絡評価される
+        """
+        Checks if a specific time is contained within the time ranges.
+        
+        If t is array-like, returns a boolean array (see contains_many).
+        """
+        if np.ndim(t) > 0:
+            return self.contains_many(t)
+        if isinstance(t, TimewithInf):
+            t = t.time_or_none()
+        t_i8 = _time_to_i8(t, _INT64_MIN)
+        
+        # tを含みうるのは、tより前に始まる区間のうち最後のものだけ
+        idx = np.searchsorted(self._starts, t_i8, side='right') - 1
+        return bool(idx >= 0 and t_i8 < self._ends[idx])
+    
+    def contains_many(self, times):
+        """
+        Checks if each of the given times is contained within the time ranges.
+        
+        Parameters
+        ----------
+        times : array-like of datetime-like
+            Times to check.
+        
+        Returns
+        -------
+        np.ndarray of bool
+            True where the corresponding time is contained within the time ranges.
+        """
+        t_i8 = _to_i8_array(times)
+        if self._n_ranges == 0:
+            return np.zeros(t_i8.shape, dtype=bool)
+        
+        # 各時刻より前に始まる区間のうち最後のものに含まれるか調べる
+        idx = np.searchsorted(self._starts, t_i8, side='right') - 1
+        return (idx >= 0) & (t_i8 < self._ends[np.maximum(idx, 0)])
     
     def overlaps(self, other):
         """Checks if two time ranges overlap."""
         if isinstance(other, TimeRange):
-            return any(r.overlaps(other) for r in self.ranges)
+            if other.is_duration_zero:
+                return False
+            # 区間は互いに素でソートされているので、終点もソートされている
+            # otherの始点より後に終わる最初の区間と、otherの終点より前に始まる最後の区間の間に
+            # 区間が存在すれば重なっている
+            lo = np.searchsorted(self._ends, other._s_i8, side='right')
+            hi = np.searchsorted(self._starts, other._e_i8, side='left')
+            return bool(lo < hi)
         elif isinstance(other, DisjointTimeRanges):
-            # TODO: ここを効率的に実装する
-            return any(self.overlaps(r) for r in other.ranges)
+            starts, _ = _sweep_i8(self._starts, self._ends, other._starts, other._ends, np.logical_and)
+            return len(starts) > 0
         else:
             raise TypeError(
                 f"Expected object of type TimeRange or DisjointTimeRange, but got {type(other).__name__}."
@@ -443,10 +858,16 @@ class DisjointTimeRanges:
     def intersection(self, other):
         """Get the intersection of this time range with another."""
         if isinstance(other, TimeRange):
-            return sum([r.intersection(other) for r in self.ranges], TimeRange.zero_range())
+            if other._is_whole():
+                return self.copy()
+            # 各区間をotherの範囲に切り詰め、長さが残ったものだけを残す
+            starts = np.maximum(self._starts, other._s_i8)
+            ends = np.minimum(self._ends, other._e_i8)
+            keep = ends > starts
+            return DisjointTimeRanges._from_i8(starts[keep], ends[keep], consolidated=True)
         elif isinstance(other, DisjointTimeRanges):
-            # TODO: ここを効率的に実装する
-            return sum([self.intersection(r) for r in other.ranges], TimeRange.zero_range())
+            starts, ends = _sweep_i8(self._starts, self._ends, other._starts, other._ends, np.logical_and)
+            return DisjointTimeRanges._from_i8(starts, ends, consolidated=True)
         else:
             raise TypeError(
                 f"Expected object of type TimeRange or DisjointTimeRange, but got {type(other).__name__}."
@@ -455,20 +876,92 @@ class DisjointTimeRanges:
     def union(self, other):
         """Get the union of this time range with another."""
         if isinstance(other, TimeRange):
-            self._consolidate_ranges()
-            new_ranges = DisjointTimeRanges(self.ranges + [other])
-            new_ranges._consolidate_ranges()
-            return new_ranges
+            if other.is_duration_zero:
+                return self.copy()
+            if other._is_whole():
+                return DisjointTimeRanges()
+            starts, ends = self._splice_i8(other._s_i8, other._e_i8)
+            return DisjointTimeRanges._from_i8(starts, ends, consolidated=True)
         elif isinstance(other, DisjointTimeRanges):
-            self._consolidate_ranges()
-            new_ranges = DisjointTimeRanges(self.ranges + other.ranges)
-            new_ranges._consolidate_ranges()
-            return new_ranges
+            # どちらもソート済みなので、安定ソートは2つの列のマージになる
+            return DisjointTimeRanges._from_i8(
+                np.concatenate((self._starts, other._starts)),
+                np.concatenate((self._ends, other._ends)),
+            )
         else:
             raise TypeError(
                 f"Expected object of type TimeRange or DisjointTimeRange, but got {type(other).__name__}."
             )
         
+    def _splice_i8(self, s_i8, e_i8):
+        """
+        Return the int64 arrays with the range [s_i8, e_i8) merged in.
+        The range must not be empty.
+        """
+        # [s_i8, e_i8)と重なるか連続する区間は、s_i8以降に終わる最初の区間から
+        # e_i8以前に始まる最後の区間まで
+        lo = np.searchsorted(self._ends, s_i8, side='left')
+        hi = np.searchsorted(self._starts, e_i8, side='right')
+        if lo < hi:
+            s_i8 = min(s_i8, self._starts[lo])
+            e_i8 = max(e_i8, self._ends[hi - 1])
+            
+        # 該当する区間をまとめた1つの区間で置き換える
+        return (
+            np.concatenate((self._starts[:lo], [s_i8], self._starts[hi:])),
+            np.concatenate((self._ends[:lo], [e_i8], self._ends[hi:])),
+        )
+    
+    def add_range(self, start=None, end=None):
+        """
+        Adds the time range [start, end) to this object in place.
+        
+        Overlapping or continuous ranges are merged with the new range.
+        
+        Parameters
+        ----------
+        start : compatible with np.datetime64, optional
+            Starting time of the range. If None, the range extends infinitely
+            into the past.
+        end : compatible with np.datetime64, optional
+            Ending time of the range. If None, the range extends infinitely
+            into the future.
+        """
+        if isinstance(start, TimewithInf):
+            start = start.time_or_none()
+        if isinstance(end, TimewithInf):
+            end = end.time_or_none()
+        s_i8 = _time_to_i8(start, _INT64_MIN)
+        e_i8 = _time_to_i8(end, _INT64_MAX)
+        if s_i8 >= e_i8:
+            return
+        
+        self._starts, self._ends = self._splice_i8(s_i8, e_i8)
+        self._ranges = None
+        self._n_ranges = len(self._starts)
+
+    def add_ranges(self, starts, ends):
+        """
+        Adds the time ranges [starts[i], ends[i]) to this object in place.
+
+        Equivalent to calling add_range for each pair, but the arrays are
+        merged in a single sort instead of being copied for each range.
+
+        Parameters
+        ----------
+        starts : array-like of datetime-like
+            Starting times of the ranges.
+        ends : array-like of datetime-like
+            Ending times of the ranges. Must have the same length as starts.
+        """
+        s_i8 = _to_i8_array(starts).ravel()
+        e_i8 = _to_i8_array(ends).ravel()
+        if len(s_i8) != len(e_i8):
+            raise ValueError("starts and ends must have the same length.")
+        self._starts = np.concatenate((self._starts, s_i8))
+        self._ends = np.concatenate((self._ends, e_i8))
+        self._consolidate_ranges()
+
     def to_array(self, unit='D'):
         """
         Returns the time values within the time ranges as a numpy array.
@@ -495,8 +988,23 @@ class DisjointTimeRanges:
         AssertionError
             If the specified unit is not compatible with numpy.datetime64.
         """
-        self._consolidate_ranges()
-        return np.concatenate([r.to_array(unit) for r in self.ranges])
+        if np.any(self._starts == _INT64_MIN) or np.any(self._ends == _INT64_MAX):
+            raise ValueError("Operation not supported for infinite time ranges.")
+        
+        np_time_units = {'Y','M','W','D','h','m','s','us','ns','ps','fs','as'}
+        assert unit in np_time_units
+        
+        # 各区間の始点・終点を指定の単位に変換した整数
+        starts = self._starts.view('datetime64[ns]').astype(f'datetime64[{unit}]').view('i8')
+        ends = self._ends.view('datetime64[ns]').astype(f'datetime64[{unit}]').view('i8')
+        
+        # 出力配列の中での各区間の開始位置
+        lens = np.maximum(ends - starts, 0)
+        offsets = np.concatenate(([0], np.cumsum(lens)))
+        
+        # 各要素 = (その要素が属する区間の始点) + (区間内での位置)
+        out = np.arange(offsets[-1], dtype=np.int64) + np.repeat(starts - offsets[:-1], lens)
+        return out.view(f'datetime64[{unit}]')
     
     def shift(self, dtime):
         """
@@ -513,36 +1021,35 @@ class DisjointTimeRanges:
         DisjointTimeRanges
             A new DisjointTimeRanges object representing the shifted time ranges.
         """
-        new_ranges = [r.shift(dtime) for r in self.ranges]
+        new_ranges = [r.shift(dtime) for r in self._get_ranges()]
         return DisjointTimeRanges(new_ranges)
         
     def __bool__(self):
-        return len(self.ranges) == 0
+        return bool(self._n_ranges)
+    
+    def __len__(self):
+        return self._n_ranges
     
     def __sub__(self, other):
         if isinstance(other, TimeRange):
-            new_ranges = []
-            for r in self.ranges:
-                substracted = r - other
-                if isinstance(substracted, TimeRange):
-                    new_ranges.append(substracted)
-                elif isinstance(substracted, DisjointTimeRanges):
-                    new_ranges += substracted.ranges
-            return DisjointTimeRanges(new_ranges)
+            if other.is_duration_zero:
+                return self.copy()
+            # 各区間について、otherより前の部分と後の部分を残す
+            # (長さ0になった区間は_consolidate_rangesで除かれる)
+            new_starts = np.concatenate((self._starts, np.maximum(self._starts, other._e_i8)))
+            new_ends = np.concatenate((np.minimum(self._ends, other._s_i8), self._ends))
+            return DisjointTimeRanges._from_i8(new_starts, new_ends)
         elif isinstance(other, DisjointTimeRanges):
-            # TODO: ここ効率的に実装する
-            new_ranges = sum([(r - other).ranges for r in self.ranges], [])
-            return DisjointTimeRanges(new_ranges)
+            starts, ends = _subtract_i8(self._starts, self._ends, other._starts, other._ends)
+            return DisjointTimeRanges._from_i8(starts, ends, consolidated=True)
         else:
             return NotImplemented
         
     def __rsub__(self, other):
         if isinstance(other, TimeRange):
-            # TODO: ここ効率的に実装する
-            new_ranges = other.copy()
-            for r in self.ranges:
-                new_ranges -= r
-            return new_ranges
+            other_starts, other_ends = _range_to_i8_arrays(other)
+            starts, ends = _subtract_i8(other_starts, other_ends, self._starts, self._ends)
+            return DisjointTimeRanges._from_i8(starts, ends, consolidated=True)
         else:
             return NotImplemented
         
@@ -569,70 +1076,256 @@ class DisjointTimeRanges:
         return self & other
     
     def __xor__(self, other):
-        if isinstance(other, (TimeRange, DisjointTimeRanges)):
-            return (self - other) | (other - self)
-        return NotImplemented
+        if isinstance(other, TimeRange):
+            other_starts, other_ends = _range_to_i8_arrays(other)
+        elif isinstance(other, DisjointTimeRanges):
+            other_starts, other_ends = other._starts, other._ends
+        else:
+            return NotImplemented
+        starts, ends = _sweep_i8(self._starts, self._ends, other_starts, other_ends, np.logical_xor)
+        return DisjointTimeRanges._from_i8(starts, ends, consolidated=True)
         
     def __rxor__(self, other):
         return self ^ other
     
     def __eq__(self, other):
         if isinstance(other, TimeRange):
-            return len(self.ranges) == 1 and self.ranges[0] == other
+            return self._n_ranges == 1 and self._get_ranges()[0] == other
         elif isinstance(other, DisjointTimeRanges):
-            # rangeをカノニカルな形式に変換する
-            self._consolidate_ranges()
-            other._consolidate_ranges()
-            
-            # rangeの数が一致するかチェック
-            if len(self.ranges) != len(other.ranges):
-                return False
-            
-            # rangeがすべて一致するかチェック
-            for r1, r2 in zip(self.ranges, other.ranges):
-                if r1 != r2:
-                    return False
-                
-            return True
+            # 区間は常にカノニカルな形式で保持されているので、配列を比較すればよい
+            return (
+                np.array_equal(self._starts, other._starts)
+                and np.array_equal(self._ends, other._ends)
+            )
         else:
             return NotImplemented
 
-class TimeSeries(SortedDict):
-    """時系列データを保存する辞書。指定時刻に近い時刻のデータをO(log(n))で探す。"""
+# TimeSeriesのkeys(), values(), items()のビュー
+# 以前のSortedDictのビューと同じく、位置(整数・スライス)で参照できる
+
+class _TimeSeriesKeysView(KeysView, Sequence):
+    def __getitem__(self, index):
+        ts = self._mapping
+        if isinstance(index, slice):
+            return [ts._dt2key(dt) for dt in ts._keys[index]]
+        return ts._dt2key(ts._keys[index])
+    
+    def index(self, key, start=None, stop=None):
+        return self._mapping.index(key, start, stop)
+
+class _TimeSeriesValuesView(ValuesView, Sequence):
+    def __getitem__(self, index):
+        return self._mapping._values[index]
+    
+    def __iter__(self):
+        # キーごとに値を引き直さない
+        return iter(self._mapping._values)
+
+class _TimeSeriesItemsView(ItemsView, Sequence):
+    def __iter__(self):
+        return zip(self._mapping, self._mapping._values)
+    
+    def __getitem__(self, index):
+        ts = self._mapping
+        if isinstance(index, slice):
+            return list(zip(ts.keys()[index], ts._values[index]))
+        return ts.peekitem(index)
+
+
+class TimeSeries(MutableMapping):
+    """
+    時系列データを保存する辞書。指定時刻に近い時刻のデータをO(log(n))で探す。
+    
+    キーはdatetime64[ns]のソート済み配列、値はそれと並行するリストで保持する。
+    キーの配列は余裕を持って確保し、時刻順の追加では配列を作り直さない。
+    
+    タイムゾーン付きのキー(pd.Timestamp, datetime.datetime)を追加したときは、
+    そのタイムゾーンを記録し、keys(), items(), last_include_now等では
+    そのタイムゾーンのpd.Timestampとしてキーを返す。
+    タイムゾーン付きのキーとタイムゾーンを持たないキーを混ぜるとTypeErrorを送出する。
+    
+    以前のSortedDictと同じく、popitemは最後の時刻から取り出し、
+    irange, index, peekitemと位置で参照できるkeys(), values(), items()を使える。
+    """
+    # キーのタイムゾーン。タイムゾーンを持たないキーのときはNone
+    _tz = None
+    
     def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+        items = dict(*args, **kwargs)
+        tzs = [getattr(key, 'tzinfo', None) for key in items]
+        if len({tz is None for tz in tzs}) > 1:
+            raise TypeError("Cannot mix tz-naive and tz-aware keys in a TimeSeries.")
+        if tzs and tzs[-1] is not None:
+            self._tz = tzs[-1]
+        keys = np.array([self._key2dt(key) for key in items], dtype='datetime64[ns]')
+        values = list(items.values())
         
-        # Convert string keys to np.datetime64
-        
-        # まだ内部ではkeyがstrの場合があるので、__getitem＿内でkeyをstrに変換しない設定にする
-        self._is_internal_key_may_str = True 
-        items = list(self.items())
-        self.clear()
-        for key, value in items:
-            self[key] = value
-        self._is_internal_key_may_str = False
+        # まとめてソートする。同じ時刻を表すキーが複数あるときは、後のものを残す
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        is_last = np.append(keys[1:] != keys[:-1], True) if len(keys) else np.zeros(0, dtype=bool)
+        self._keys = keys[is_last]
+        self._values = [values[i] for i in order[is_last].tolist()]
+            
+    @classmethod
+    def _from_arrays(cls, keys, values, tz=None):
+        obj = cls.__new__(cls)
+        obj._keys = keys
+        obj._values = values
+        obj._tz = tz
+        return obj
+    
+    @property
+    def _keys(self):
+        # バッファのうち使用中の部分
+        return self._key_buffer[:self._n_keys]
+    
+    @_keys.setter
+    def _keys(self, keys):
+        self._key_buffer = keys
+        self._n_keys = len(keys)
     
     def _key2dt(self, key):
-        if isinstance(key, str):
-            return np.datetime64(key)
-        else:
-            return key
+        return _to_datetime64_ns(key)
+    
+    def _check_tz(self, key):
+        """追加するkeyのタイムゾーンを記録する。既存のキーとタイムゾーンの有無が異なるときはTypeErrorを送出する"""
+        tz = getattr(key, 'tzinfo', None)
+        if not len(self):
+            self._tz = tz
+        elif (tz is None) != (self._tz is None):
+            raise TypeError("Cannot mix tz-naive and tz-aware keys in a TimeSeries.")
+    
+    def _dt2key(self, dt):
+        """内部のdatetime64[ns]のキーを、返り値のキーにする"""
+        if self._tz is None:
+            return dt
+        return pd.Timestamp(dt).tz_localize('UTC').tz_convert(self._tz)
+    
+    def _index_of_key(self, key):
+        """keyの位置を返す。keyが存在しないときはKeyErrorを送出する"""
+        try:
+            dt = self._key2dt(key)
+        except (ValueError, TypeError):
+            # 時刻に変換できないキーは存在しないキーとして扱う (inやgetがFalse, Noneを返すように)
+            raise KeyError(key) from None
+        i = int(np.searchsorted(self._keys, dt, side='left'))
+        if i == len(self._keys) or self._keys[i] != dt:
+            raise KeyError(key)
+        return i
         
     def __getitem__(self, key):
         if isinstance(key, slice):
             # key.step は無視する
-            start = self._key2dt(key.start)
-            stop = self._key2dt(key.stop)
-            return TimeSeries({k: self[k] for k in self.irange(start, stop, inclusive=(True, False))})
+            lo = 0 if key.start is None else self.bisect_left(key.start)
+            hi = len(self._keys) if key.stop is None else self.bisect_left(key.stop)
+            return TimeSeries._from_arrays(self._keys[lo:hi].copy(), self._values[lo:hi], self._tz)
         else:
-            if not self._is_internal_key_may_str:
-                # __init__終了後、keyがstrの可能性がなくなったら
-                # keyがstrのときは自動的にnp.datetime64に変換する
-                key = self._key2dt(key)
-            return super().__getitem__(key)
+            return self._values[self._index_of_key(key)]
         
     def __setitem__(self, key, value):
-        super().__setitem__(self._key2dt(key), value)
+        self._check_tz(key)
+        key = self._key2dt(key)
+        n = self._n_keys
+        if n == 0 or self._key_buffer[n - 1] < key:
+            # 時刻順に追加されるとき
+            if n == len(self._key_buffer):
+                # バッファが埋まっていれば、容量を倍にして確保し直す
+                buffer = np.empty(max(8, 2 * n), dtype='datetime64[ns]')
+                buffer[:n] = self._key_buffer
+                self._key_buffer = buffer
+            self._key_buffer[n] = key
+            self._n_keys = n + 1
+            self._values.append(value)
+            return
+        
+        i = int(np.searchsorted(self._keys, key, side='left'))
+        if self._keys[i] == key:
+            self._values[i] = value
+        else:
+            self._keys = np.insert(self._keys, i, key)
+            self._values.insert(i, value)
+            
+    def __delitem__(self, key):
+        i = self._index_of_key(key)
+        self._keys = np.delete(self._keys, i)
+        del self._values[i]
+        
+    def __iter__(self):
+        if self._tz is None:
+            return iter(self._keys)
+        return (self._dt2key(dt) for dt in self._keys)
+    
+    def __len__(self):
+        return self._n_keys
+    
+    def __repr__(self):
+        items = ', '.join(f'{k!r}: {v!r}' for k, v in zip(self, self._values))
+        return f"{type(self).__name__}({{{items}}})"
+    
+    def copy(self):
+        return TimeSeries._from_arrays(self._keys.copy(), list(self._values), self._tz)
+    
+    def keys(self):
+        return _TimeSeriesKeysView(self)
+    
+    def values(self):
+        return _TimeSeriesValuesView(self)
+    
+    def items(self):
+        return _TimeSeriesItemsView(self)
+    
+    def popitem(self, index=-1):
+        """指定位置(デフォルトは最後)の(時刻, 値)を取り除いて返す"""
+        if not self._n_keys:
+            raise KeyError('popitem(): dictionary is empty')
+        i = range(self._n_keys)[index]
+        item = self.peekitem(i)
+        if i == self._n_keys - 1:
+            # 最後の時刻のときは、配列を作り直さない
+            self._n_keys -= 1
+            self._values.pop()
+        else:
+            self._keys = np.delete(self._keys, i)
+            del self._values[i]
+        return item
+    
+    def index(self, key, start=None, stop=None):
+        """keyの位置を返す。start以上stop未満の位置にkeyがないときはValueErrorを送出する"""
+        try:
+            i = self._index_of_key(key)
+        except KeyError:
+            raise ValueError(f"{key!r} is not in TimeSeries") from None
+        start, stop, _ = slice(start, stop).indices(self._n_keys)
+        if not start <= i < stop:
+            raise ValueError(f"{key!r} is not in TimeSeries")
+        return i
+    
+    def irange(self, minimum=None, maximum=None, inclusive=(True, True), reverse=False):
+        """
+        minimumからmaximumまでのキーを時刻順に返すイテレータ。
+        inclusiveで両端を含めるかを指定し、reverseがTrueのときは逆順に返す。
+        """
+        lo = 0
+        if minimum is not None:
+            lo = self.bisect_left(minimum) if inclusive[0] else self.bisect_right(minimum)
+        hi = self._n_keys
+        if maximum is not None:
+            hi = self.bisect_right(maximum) if inclusive[1] else self.bisect_left(maximum)
+        keys = self._keys[lo:hi]
+        if reverse:
+            keys = keys[::-1]
+        return (self._dt2key(dt) for dt in keys)
+    
+    def bisect_left(self, key):
+        return int(np.searchsorted(self._keys, self._key2dt(key), side='left'))
+    
+    def bisect_right(self, key):
+        return int(np.searchsorted(self._keys, self._key2dt(key), side='right'))
+    
+    def peekitem(self, index=-1):
+        """指定位置の(時刻, 値)を返す"""
+        return self._dt2key(self._keys[index]), self._values[index]
     
     def _index_of_last_inclusive(self, key): 
         return self.bisect_right(key) - 1
@@ -668,258 +1361,1378 @@ class TimeSeries(SortedDict):
         else:
             return self.peekitem(i)
         
-# -------trade_time関連----------
+# -------待機関連----------
+
+# windowsのクロック解像度はデフォルトでは1/64秒=15.625ミリ秒
+# 短い時間待つときだけ、これをより短く設定する
+DTIME = 1
+
+# これより長く待つときは、デフォルトのクロック解像度で十分とする
+_HIGH_RES_WAIT_LIMIT = 0.02
+
+try:
+    from ctypes import windll
+except ImportError as e:
+    # LINUX等のとき
+    WINDOWS=False
+else:
+    WINDOWS=True
+
+class _HighResTimer:
+    """
+    withブロックの間だけクロック解像度をDTIMEミリ秒にする。
+    クロック解像度の変更はプロセス全体に影響するので、必要な間だけにとどめる。
+    """
+    def __enter__(self):
+        if WINDOWS:
+            windll.winmm.timeBeginPeriod(DTIME)
+        return self
+    
+    def __exit__(self, *args):
+        if WINDOWS:
+            # クロック解像度の変更をもとに戻す
+            windll.winmm.timeEndPeriod(DTIME)
+
+def wait(seconds):
+    """
+    プログラムを指定秒数停止させる。
+    """
+    if seconds > _HIGH_RES_WAIT_LIMIT:
+        time_module.sleep(seconds)
+    elif seconds > 0:
+        with _HighResTimer():
+            time_module.sleep(seconds)
+
+def create_wait_if_pace_too_fast():
+    """
+    wait_if_pace_too_fast関数を作る。
+    前回呼ばれた時刻はモジュールごとに別々に持つので、timemanagerとnotzでそれぞれ作る。
+    """
+    # wait_if_pace_too_fast 関数が最後に呼ばれた時刻 (エポックからのナノ秒)
+    time_last_called = None
+    
+    def wait_if_pace_too_fast(dtime_second = 1):
+        """
+        前回にこの関数を呼び出したときから指定時間以上経過していなければ、
+        指定時間経過するまで待つ
+        """
+        nonlocal time_last_called
         
-def previous_day(date):
-    return date - datetime.timedelta(days=1)
+        # 経過時間だけが問題なので、pandasを通さずにナノ秒(int)で計算する
+        if time_last_called is not None:
+            end_ns = time_last_called + int(dtime_second * 1e9)
+            wait((end_ns - time_module.time_ns()) / 1e9)
+        time_last_called = time_module.time_ns()
     
-def next_day(date):
-    return date + datetime.timedelta(days=1)
+    return wait_if_pace_too_fast
 
+# -------時刻の変換関連----------
+# timemanagerとnotzで共通の実装。現在時刻が必要なときのために、それぞれのnow関数を受け取る
 
-def create_trade_time_obj(to_date, TIMEZONE, now):
-    class _TradeTime:
-        def __init__(self, date=None):
-            self.set_time_of_quotes(date=date)
+@lru_cache(maxsize=4096)
+def _parse_datetime_str(time_str):
+    """文字列の時刻を変換する。同じ文字列が何度も渡されるので、結果をキャッシュする"""
+    return pd.to_datetime(time_str).to_pydatetime(warn=False)
 
-        def set_time_of_quotes(self, date):
-            if date is None:
-                date = now().date()
-            else:
-                date = to_date(date)
-
-            if ('date' not in dir(self)) or (date != self.date):
-                # この関数を初めて呼び出すか、
-                # 前回呼び出した時から日付が変わっていた時
-                date_args = {
-                    "year": date.year, 
-                    "month": date.month, 
-                    "day": date.day, 
-                    "tz": TIMEZONE,
-                }
-                self.zenba_first = pd.Timestamp(**date_args, hour=9, minute=0)
-                self.zenba_last = pd.Timestamp(**date_args, hour=11, minute=30)
-                self.goba_first = pd.Timestamp(**date_args, hour=12, minute=30)
-                if date >= datetime.date(year=2024, month=11, day=5):
-                    # 取引時間延長後のとき
-                    self.is_after_arrowhead4 = True
-                    self.goba_last = pd.Timestamp(**date_args, hour=15, minute=30)
-                    self.five_minutes_before_goba_last = pd.Timestamp(**date_args, hour=15, minute=25) # クロージング・オークション開始
-                else:
-                    # 取引時間延長前のとき
-                    self.is_after_arrowhead4 = False
-                    self.goba_last = pd.Timestamp(**date_args, hour=15, minute=00)
-                    self.five_minutes_before_goba_last = pd.Timestamp(**date_args, hour=14, minute=55) # 引け5分前(※ザラ場)
-                self.is_business_day = TradeTime.is_business_day(date)
-                
-                self.date = date
-
-        def is_lunch_break(self, time=None, inclusive=False):
-            if not self.is_business_day: return False
-            time = time or now()
-            if inclusive:
-                return (self.zenba_last <= time <= self.goba_first)
-            else:
-                return (self.zenba_last < time < self.goba_first)
+# 年月日がすべて書かれた文字列 (2023-01-01, 20230101 など)
+# それ以外('today'や時刻だけの文字列など)は結果が現在時刻によって変わりうるので、キャッシュしない
+_ABSOLUTE_DATE_STR = re.compile(r'\d{4}-?\d{2}-?\d{2}')
 
-        def is_before_start(self, time=None, inclusive=False):
-            if not self.is_business_day: return False
-            time = time or now()
-            if inclusive:
-                return (time <= self.zenba_first)
-            else:
-                return (time < self.zenba_first)
+def _str_to_datetime(time_str, now):
+    if time_str == 'now':
+        return now().to_pydatetime(warn=False)
+    if _ABSOLUTE_DATE_STR.match(time_str):
+        return _parse_datetime_str(time_str)
+    return pd.to_datetime(time_str).to_pydatetime(warn=False)
 
-        def is_after_end(self, time=None, inclusive=False):
-            if not self.is_business_day: return False
-            time = time or now()
-            if inclusive:
-                return (self.goba_last <= time)
-            else:
-                return (self.goba_last < time)
+def _to_datetime_by_isinstance(time_obj, now):
+    """型が_TO_DATETIMEにないとき(サブクラス等)の変換"""
+    if isinstance(time_obj, datetime.datetime):
+        return time_obj
+    elif isinstance(time_obj, datetime.date):
+        return datetime.datetime(time_obj.year, time_obj.month, time_obj.day)
+    elif isinstance(time_obj, np.datetime64):
+        return pd.Timestamp(time_obj).to_pydatetime(warn=False)
+    elif isinstance(time_obj, str): 
+        return _str_to_datetime(time_obj, now)
+    else:
+        raise ValueError("Unsupported type")
 
-        def is_trading_hours(self, time=None, inclusive=True):
-            if not self.is_business_day: return False
-            time = time or now()
-            if inclusive:
-                return (self.zenba_first <= time <= self.zenba_last) or (self.goba_first <= time <= self.goba_last)
-            else:
-                return (self.zenba_first < time < self.zenba_last) or (self.goba_first < time < self.goba_last)
+# _to_datetimeで、型ごとに変換する関数
+# pandas.Timestampはdatetime.datetimeのサブクラスなので、そのまま返す
+_TO_DATETIME = {
+    datetime.datetime: lambda x, now: x,
+    pd.Timestamp: lambda x, now: x,
+    datetime.date: lambda x, now: datetime.datetime(x.year, x.month, x.day),
+    np.datetime64: lambda x, now: pd.Timestamp(x).to_pydatetime(warn=False),
+    str: _str_to_datetime,
+}
 
-        def is_last_five_minutes(self, time=None, inclusive=True):
-            if not self.is_business_day: return False
-            time = time or now()
-            if inclusive:
-                return (self.five_minutes_before_goba_last <= time <= self.goba_last)
-            else:
-                return (self.five_minutes_before_goba_last < time < self.goba_last)
+def _to_datetime(time_obj, now):
+    handler = _TO_DATETIME.get(type(time_obj), _to_datetime_by_isinstance)
+    return handler(time_obj, now)
 
-        def is_closing_auction(self, time=None, inclusive=True):
-            if self.is_business_day and self.is_after_arrowhead4:
-                return self.is_last_five_minutes(time=time, inclusive=inclusive)
-            else:
-                return False
+# _time_to_nsで、型ごとにエポックからのナノ秒(int)を求める関数
+_TIME2NS = {
+    pd.Timestamp: lambda t: t.value,
+    np.datetime64: lambda t: int(t.astype('datetime64[ns]').view('i8')),
+}
 
+def _time_to_ns(t, now):
+    """time2intのために、時刻をエポックからのナノ秒(int)に変換する"""
+    to_ns = _TIME2NS.get(type(t))
+    if to_ns is not None:
+        return to_ns(t)
+    elif t == 'now':
+        return now().value
+    else:
+        return int(np.datetime64(t, 'ns').view('i8'))
 
-    class TradeTime:
-        def __init__(self):
-            self._date2trade_time_obj = {}
-            
-        def __getitem__(self, value):
-            # デフォルトは現在時刻
-            if value is None:
-                value = now()
-                
-            # 指定日の_TradeTimeオブジェクトを未作成なら作る
-            date = to_date(value)
-            if date not in self._date2trade_time_obj:
-                self._date2trade_time_obj[date] = _TradeTime(date)
-                
-            # 指定日の_TradeTimeオブジェクトを返す
-            return self._date2trade_time_obj[date]
-        
-        def zenba_first(self, date=None):
-            return self[date].zenba_first
-        
-        def zenba_last(self, date=None):
-            return self[date].zenba_last
-        
-        def goba_first(self, date=None):
-            return self[date].goba_first
-        
-        def goba_last(self, date=None):
-            return self[date].goba_last
-            
-        def is_lunch_break(self, time=None, inclusive=False):
-            return self[time].is_lunch_break(time, inclusive)
-            
-        def is_before_start(self, time=None, inclusive=False):
-            return self[time].is_before_start(time, inclusive)
-        
-        def is_after_end(self, time=None, inclusive=False):
-            return self[time].is_after_end(time, inclusive)
-        
-        def is_trading_hours(self, time=None, inclusive=True):
-            return self[time].is_trading_hours(time, inclusive)
-        
-        def is_last_five_minutes(self, time=None, inclusive=True):
-            return self[time].is_last_five_minutes(time, inclusive)
-        
-        def is_closing_auction(self, time=None, inclusive=True):
-            return self[time].is_closing_auction(time, inclusive)
-            
-        @staticmethod
-        def settlement_date(trade_date):
-            """約定日から受渡日を計算する"""
-            trade_date = to_date(trade_date) 
-            if trade_date < datetime.date(2019, 7, 16):
-                delta = 3 # 2019年7月16日より前は4営業日目が受渡日
-            else:
-                delta = 2 # 2019年7月16日以降は3営業日目が受渡日
-
-            res = trade_date
-            for i in range(delta):
-                res = TradeTime.next_business_day(res)
-
-            return res
-        
-        @staticmethod
-        def is_business_day(time_obj):
-            """
-            銀行カレンダーにおいて営業日か判定する
-
-            Parameters
-            ----------
-            time_obj : datetime-like object
-                datetime.datetime, datetime.date, numpy.datetime64, pd.Timestamp, str型など
-                str型の場合はpd.Timestampを通して変換する
-
-            Returns
-            -------
-            res : boolean
-                営業日か。土日祝または12/31 ~ 01/03 ならばFalse、それ以外ならTrue
-            """
-            # datetime.date型に変換する
-            date = to_date(time_obj)
-
-            # 祝日かどうかを判定
-            if jpholiday.is_holiday(date):
-                return False
+def _encode_time_int(ns):
+    """
+    エポックからのナノ秒をtime2intの整数にする。
+    既存の値との互換性のため、ナノ秒のバイト列をビッグエンディアンとして読んだ値を返す
+    """
+    return int(np.array(ns, dtype=np.int64).view('>u8'))
 
-            # 土曜日かどうかを判定
-            if date.weekday() == 5:
-                return False
+def _decode_time_int(n):
+    """_encode_time_intの逆変換。ビッグエンディアンとして格納し、そのバイト列をナノ秒として読む"""
+    return np.array(n, dtype='>u8').view('datetime64[ns]')[()]
 
-            # 日曜日かどうかを判定
-            if date.weekday() == 6:
-                return False
+# -------trade_time関連----------
 
-            # 12月31日から1月3日までの期間は休みと判定
-            if date.month == 12 and date.day >= 31:
-                return False
-            if date.month == 1 and date.day <= 3:
-                return False
+# 呼び出しのたびに作らないよう、1日を表すtimedeltaを使い回す
+_ONE_DAY = datetime.timedelta(days=1)
+        
+def previous_day(date):
+    return date - _ONE_DAY
+    
+def next_day(date):
+    return date + _ONE_DAY
 
-            # 上記条件に当てはまらなければ営業日と判定
-            return True
-        
-        @staticmethod
-        def next_business_day(time_obj, include_now=False):
-            """
-            銀行カレンダーにおける次の営業日を返す。
-
-            Parameters
-            ----------
-            time_obj : datetime-like object
-                datetime.datetime, datetime.date, numpy.datetime64, pd.Timestamp, str型など
-                str型の場合はpd.Timestampを通して変換する
-
-            include_now : bool, default: False
-                if True, 入力が営業日ならそのまま返す。
-                if False, 前日以降で最も近い営業日を返す
-
-            Returns
-            -------
-            res : datetime.date object
-                次の営業日。
-            """
-            date = to_date(time_obj)
-            if not include_now:
-                date = next_day(date)
-
-            while not TradeTime.is_business_day(date):
-                date = next_day(date)
-            return date
-
-        @staticmethod
-        def previous_business_day(time_obj, include_now=False):
-            """
-            銀行カレンダーにおける前の営業日を返す。
-
-            Parameters
-            ----------
-            time_obj : datetime-like object
-                datetime.datetime, datetime.date, numpy.datetime64, pd.Timestamp, str型など
-                str型の場合はpd.Timestampを通して変換する
-
-            include_now : bool, default: False
-                if True, 入力が営業日ならそのまま返す。
-                if False, 前日以前で最も近い営業日を返す
-
-            Returns
-            -------
-            res : datetime.date object
-                前の営業日。
-            """
-            date = to_date(time_obj)
-            if not include_now:
-                date = previous_day(date)
-
-            while not TradeTime.is_business_day(date):
-                date = previous_day(date)
-            return date
-        
-    return TradeTime()
+def _timestamp_to_ns(time, TIMEZONE):
+    """
+    時刻を、取引時間の境界と比べるためのエポックからのナノ秒(int)に変換する。
+
+    numpy.datetime64はUTCの時刻とみなす。
+    タイムゾーンを持たないそれ以外の時刻(str, datetime.datetime, pd.Timestamp)は、TIMEZONEの時刻とみなす。
+    TIMEZONEがNoneのときは、タイムゾーン付きの時刻はその地域の時刻としてタイムゾーンを外す。
+    """
+    if isinstance(time, np.datetime64):
+        # pd.Timestampを作らずに、ナノ秒に揃えて値を取り出す
+        return _to_i8(time)
+    if TIMEZONE is not None and getattr(time, 'tzinfo', None) is not None:
+        # タイムゾーン付きの時刻は、そのままエポックからのナノ秒を取り出す
+        if isinstance(time, pd.Timestamp):
+            return time.value
+        if isinstance(time, datetime.datetime):
+            return (time - _EPOCH_UTC) // _ONE_MICROSECOND * 1000
+    if not isinstance(time, pd.Timestamp):
+        time = pd.Timestamp(time)
+    if TIMEZONE is None:
+        if time.tz is not None:
+            time = time.tz_localize(None)
+    elif time.tz is None:
+        time = time.tz_localize(TIMEZONE)
+    return time.value
+
+def _timestamps_to_ns(times, TIMEZONE):
+    """
+    _timestamp_to_nsの配列版。
+    入れ物の型によらず、スカラーと同じく要素の型で扱いを決める。
+    numpy.datetime64の要素はUTCの時刻とみなし、タイムゾーンを持たないそれ以外の要素はTIMEZONEの時刻とみなす。
+
+    Parameters
+    ----------
+    times : array-like of datetime-like
+        np.ndarray of datetime64, pd.DatetimeIndex, 時刻のリストなど
+
+    Returns
+    -------
+    t_ns : np.ndarray of int64
+        各時刻のエポックからのナノ秒
+    """
+    if not isinstance(times, (pd.Index, pd.Series)):
+        a = np.asarray(times)
+        if a.dtype.kind == 'M':
+            # numpy.datetime64のリストもここに来る
+            return _to_i8_array(a)
+        if a.dtype == object and any(isinstance(t, np.datetime64) for t in a.flat):
+            # numpy.datetime64とそれ以外が混ざっているときは、要素ごとに変換する
+            return np.array([_timestamp_to_ns(t, TIMEZONE) for t in a.flat], dtype=np.int64)
+    # pd.DatetimeIndexやpd.Seriesの要素はpd.Timestampなので、タイムゾーンを持たなければTIMEZONEの時刻とみなす
+    index = pd.DatetimeIndex(times)
+    if TIMEZONE is None:
+        if index.tz is not None:
+            index = index.tz_localize(None)
+    elif index.tz is None:
+        index = index.tz_localize(TIMEZONE)
+    return index.as_unit('ns').asi8
+
+_NS_PER_MINUTE = 60 * 10**9
+_NS_PER_DAY = 24 * 60 * _NS_PER_MINUTE
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+@lru_cache(maxsize=None)
+def _get_tzinfo(TIMEZONE):
+    """タイムゾーン名に対応するtzinfoを返す"""
+    return pd.Timestamp(0, tz=TIMEZONE).tzinfo
+
+_EPOCH_UTC = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+
+def _local_days(t_ns, TIMEZONE):
+    """
+    エポックからのナノ秒を、その時刻の(TIMEZONEでの)日付のエポックからの日数にする。
+    TIMEZONEがNoneのときは、タイムゾーンを持たない時刻として扱う。
+    スカラーの判定と配列の判定で同じ日付を使うよう、どちらもこの関数で日付を決める。
+
+    Parameters
+    ----------
+    t_ns : int or np.ndarray of int64
+        エポックからのナノ秒
+
+    Returns
+    -------
+    days : int or np.ndarray of int64
+        エポックからの日数
+    """
+    if TIMEZONE is None:
+        return t_ns // _NS_PER_DAY
+    if isinstance(t_ns, np.ndarray):
+        local = pd.DatetimeIndex(t_ns.view('datetime64[ns]')).tz_localize('UTC').tz_convert(_get_tzinfo(TIMEZONE))
+        return local.tz_localize(None).as_unit('ns').asi8 // _NS_PER_DAY
+    # スカラーはpd.Timestampを作らずに、datetimeで現地の日付を求める
+    utc = _EPOCH_UTC + _ONE_MICROSECOND * (t_ns // 1000)
+    return utc.astimezone(_get_tzinfo(TIMEZONE)).toordinal() - _EPOCH_ORDINAL
+
+def _local_midnight_ns(date, TIMEZONE):
+    """
+    指定日の(TIMEZONEでの)0時をエポックからのナノ秒(int)で返す。
+    TIMEZONEがNoneのときは、タイムゾーンを持たない時刻として扱う。
+    """
+    midnight_ns = (date.toordinal() - _EPOCH_ORDINAL) * _NS_PER_DAY
+    if TIMEZONE is None:
+        return midnight_ns
+    # 夏時間の切り替えを避けて、正午時点のUTCからのずれを使う
+    noon = datetime.datetime(date.year, date.month, date.day, 12)
+    utc_offset = _get_tzinfo(TIMEZONE).utcoffset(noon)
+    return midnight_ns - (utc_offset // _ONE_MICROSECOND) * 1000
+
+# 営業日のビットマップで扱う範囲
+_HOLIDAY_YEARS = range(1970, 2100)
+
+@lru_cache(maxsize=256)
+def _year_holiday_ordinals(year):
+    """
+    指定年の祝日の集合を、序数(date.toordinal())で返す。
+    jpholidayで1年分を求めるのに数十msかかるので、参照された年の分だけ作ってキャッシュする。
+    """
+    return frozenset(d.toordinal() for d, _ in jpholiday.year_holidays(year))
+
+def _is_holiday(date):
+    """祝日か判定する"""
+    return date.toordinal() in _year_holiday_ordinals(date.year)
+
+# 営業日のビットマップ
+# _HOLIDAY_YEARSの初日からの日数をインデックスとし、営業日のビットを立てたuint64の配列
+# 土日・年末年始は最初に参照されたときにまとめて求め、祝日は年ごとに参照されたときに反映する
+_BDAY_FIRST_ORDINAL = datetime.date(_HOLIDAY_YEARS.start, 1, 1).toordinal()
+_BDAY_END_ORDINAL = datetime.date(_HOLIDAY_YEARS.stop, 1, 1).toordinal()
+_BDAY_N_WORDS = -(-(_BDAY_END_ORDINAL - _BDAY_FIRST_ORDINAL) // 64)
+_bday_bitmap = None
+_bday_years_ready = set()
+# ファイルに保存していない祝日の反映があるか
+_bday_cache_dirty = False
+
+# ビットマップはプロセスをまたいで再利用できるようにファイルに保存する
+# ファイルの中身は、ヘッダ・各年の祝日を反映済みかのフラグ(8バイト境界まで埋める)・ビットマップの順
+_BDAY_CACHE_HEADER = '<4sIII32s'
+_BDAY_CACHE_FLAGS_SIZE = -(-len(_HOLIDAY_YEARS) // 8) * 8
+
+def _bday_cache_path():
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'timemanager', 'bday_bitmap_v1.bin')
+
+def _bday_cache_header():
+    """キャッシュファイルのヘッダ。範囲やjpholidayのバージョンが変われば一致しなくなる"""
+    try:
+        jpholiday_version = metadata.version('jpholiday')
+    except metadata.PackageNotFoundError:
+        jpholiday_version = ''
+    return struct.pack(
+        _BDAY_CACHE_HEADER, b'TMBD', _BDAY_FIRST_ORDINAL, _BDAY_N_WORDS, len(_HOLIDAY_YEARS), 
+        jpholiday_version.encode(),
+    )
+
+def _load_bday_cache():
+    """
+    保存したビットマップを読み込む。
+    書き込み時にコピーするモードでmmapするので、祝日を反映してもファイルは変わらない。
+    使えるファイルがないときはNoneを返す。
+    """
+    path = _bday_cache_path()
+    header = _bday_cache_header()
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(len(header) + _BDAY_CACHE_FLAGS_SIZE)
+        if len(head) != len(header) + _BDAY_CACHE_FLAGS_SIZE or head[:len(header)] != header:
+            return None
+        bitmap = np.memmap(
+            path, dtype='<u8', mode='c', offset=len(head), shape=(_BDAY_N_WORDS,),
+        )
+    except (OSError, ValueError):
+        return None
+    
+    flags = head[len(header):]
+    years_ready = {year for year, flag in zip(_HOLIDAY_YEARS, flags) if flag}
+    return np.asarray(bitmap), years_ready
+
+def _save_bday_cache():
+    """ビットマップを保存する。保存できなくても処理は続ける"""
+    path = _bday_cache_path()
+    bitmap = _bday_bitmap
+    years_ready = set(_bday_years_ready)
+    # 他のプロセスが先に保存していれば、その結果も合わせて保存する
+    # (祝日を反映していない年は土日・年末年始以外のビットがすべて立っているので、ビットごとのANDで合わせられる)
+    cache = _load_bday_cache()
+    if cache is not None:
+        bitmap = bitmap & cache[0]
+        years_ready |= cache[1]
+        del cache
+    flags = bytes(year in years_ready for year in _HOLIDAY_YEARS)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 読み込み中の他のプロセスが壊れたファイルを見ないように、一時ファイルから置き換える
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_bday_cache_header())
+                f.write(flags.ljust(_BDAY_CACHE_FLAGS_SIZE, b'\0'))
+                f.write(bitmap.tobytes())
+            os.replace(tmp_path, path)
+        except OSError:
+            os.remove(tmp_path)
+            raise
+    except OSError:
+        pass
+
+def _year_days(first_year, stop_year):
+    """first_yearの1月1日からstop_yearの1月1日の前日までのdatetime64[D]の配列"""
+    return np.arange(
+        np.datetime64(first_year - 1970, 'Y').astype('datetime64[D]'), 
+        np.datetime64(stop_year - 1970, 'Y').astype('datetime64[D]'),
+    )
+
+def _is_weekday_not_year_end(days):
+    """datetime64[D]の配列の各日付が、土日でも年末年始(12/31 ~ 01/03)でもないか判定する"""
+    # 1970-01-01は木曜日
+    weekday = (days.view('i8') + 3) % 7
+    month = days.astype('datetime64[M]').view('i8') % 12 + 1
+    day = (days - days.astype('datetime64[M]')).view('i8') + 1
+    is_year_end = ((month == 12) & (day >= 31)) | ((month == 1) & (day <= 3))
+    return (weekday < 5) & ~is_year_end
+
+def _build_bday_bitmap():
+    """祝日を除いた(土日・年末年始のみ考慮した)営業日のビットマップを作る"""
+    is_bday = _is_weekday_not_year_end(_year_days(_HOLIDAY_YEARS.start, _HOLIDAY_YEARS.stop))
+    
+    # 64日ごとに1つのuint64にまとめる(下位ビットほど前の日付)
+    n_words = -(-len(is_bday) // 64)
+    is_bday = np.concatenate((is_bday, np.zeros(n_words * 64 - len(is_bday), dtype=bool)))
+    return np.packbits(is_bday, bitorder='little').view('<u8')
+
+def _save_bday_cache_at_exit():
+    """祝日を反映した年があれば、終了時に一度だけビットマップを保存する"""
+    if _bday_cache_dirty:
+        _save_bday_cache()
+
+def _ensure_bday_year(year):
+    """指定年の祝日をビットマップに反映し、ビットマップを返す"""
+    global _bday_bitmap, _bday_cache_dirty
+    if _bday_bitmap is None:
+        cache = _load_bday_cache()
+        if cache is None:
+            _bday_bitmap = _build_bday_bitmap()
+        else:
+            _bday_bitmap, years_ready = cache
+            _bday_years_ready.update(years_ready)
+    if year not in _bday_years_ready:
+        for ordinal in _year_holiday_ordinals(year):
+            idx = ordinal - _BDAY_FIRST_ORDINAL
+            _bday_bitmap[idx >> 6] &= np.uint64(~(1 << (idx & 63)) & 0xFFFF_FFFF_FFFF_FFFF)
+        _bday_years_ready.add(year)
+        if not _bday_cache_dirty:
+            # 年ごとに保存すると判定のたびにファイル全体を書き直すので、終了時にまとめて保存する
+            _bday_cache_dirty = True
+            atexit.register(_save_bday_cache_at_exit)
+    return _bday_bitmap
+
+def _is_business_day(date):
+    """
+    銀行カレンダーにおいて営業日か判定する。
+    ビットマップの範囲内の日付はビットを引くだけで判定する。
+
+    Parameters
+    ----------
+    date : datetime.date object
+
+    Returns
+    -------
+    res : boolean
+        営業日か。土日祝または12/31 ~ 01/03 ならばFalse、それ以外ならTrue
+    """
+    ordinal = date.toordinal()
+    if not (_BDAY_FIRST_ORDINAL <= ordinal < _BDAY_END_ORDINAL):
+        table = _year_bday_bytes(date.year)
+        return table[ordinal - datetime.date(date.year, 1, 1).toordinal()] == 1
+    bitmap = _ensure_bday_year(date.year)
+    idx = ordinal - _BDAY_FIRST_ORDINAL
+    return bool((int(bitmap[idx >> 6]) >> (idx & 63)) & 1)
+
+def _bday_bits(i0, i1):
+    """
+    ビットマップのインデックス[i0, i1)の各日が営業日かをboolの配列で返す。
+    該当する年の祝日は反映済みであること。
+    """
+    bits = np.unpackbits(_bday_bitmap.view(np.uint8)[i0 >> 3:(i1 + 7) >> 3], bitorder='little')
+    offset = i0 & 7
+    return bits[offset:offset + (i1 - i0)].astype(bool)
+
+def _bday_index_in_range(idx):
+    return (0 <= idx) & (idx < _BDAY_END_ORDINAL - _BDAY_FIRST_ORDINAL)
+
+def _ensure_bday_years_of(idx):
+    """ビットマップのインデックスの配列について、各日付の年の祝日をビットマップに反映する"""
+    days = (idx + (_BDAY_FIRST_ORDINAL - _EPOCH_ORDINAL)).astype('datetime64[D]')
+    for year in np.unique(days.astype('datetime64[Y]').astype(np.int64) + 1970).tolist():
+        _ensure_bday_year(year)
+
+def _count_business_days(start, end):
+    """[start, end)に含まれる営業日の数を返す"""
+    if start >= end:
+        return 0
+    i0 = start.toordinal() - _BDAY_FIRST_ORDINAL
+    i1 = end.toordinal() - _BDAY_FIRST_ORDINAL
+    if i0 < 0 or _BDAY_END_ORDINAL - _BDAY_FIRST_ORDINAL < i1:
+        # ビットマップの範囲外を含むときは1日ずつ数える
+        return sum(
+            _is_business_day(datetime.date.fromordinal(o)) 
+            for o in range(start.toordinal(), end.toordinal())
+        )
+    
+    for year in range(start.year, datetime.date.fromordinal(end.toordinal() - 1).year + 1):
+        _ensure_bday_year(year)
+    return int(np.count_nonzero(_bday_bits(i0, i1)))
+
+def _is_business_day_array(days):
+    """datetime64[D]の配列の各日付が営業日か判定する"""
+    idx = days.astype(np.int64) - (_BDAY_FIRST_ORDINAL - _EPOCH_ORDINAL)
+    if not _bday_index_in_range(idx).all():
+        # ビットマップの範囲外を含むときは1日ずつ判定する
+        return np.array([_is_business_day(d) for d in days.tolist()], dtype=bool)
+    
+    _ensure_bday_years_of(idx)
+    words = _bday_bitmap[idx >> 6]
+    return ((words >> (idx & 63).astype(np.uint64)) & np.uint64(1)).astype(bool)
+
+# これより長く営業日が途切れることはない
+_MAX_BDAY_GAP = 32
+
+def _next_business_day_array(days, include_now):
+    """
+    datetime64[D]の配列の各日付について、次の営業日を返す。
+    ビットマップで求められない日付を含むときはNoneを返す。
+    """
+    if not include_now:
+        days = days + np.timedelta64(1, 'D')
+    idx = days.astype(np.int64) - (_BDAY_FIRST_ORDINAL - _EPOCH_ORDINAL)
+    if len(idx) == 0:
+        return days
+    lo = int(idx.min())
+    hi = int(idx.max()) + _MAX_BDAY_GAP
+    if lo < 0 or _BDAY_END_ORDINAL - _BDAY_FIRST_ORDINAL < hi:
+        return None
+    
+    # 各日付から_MAX_BDAY_GAP日先までの年の祝日が反映されていればよい
+    _ensure_bday_years_of(np.concatenate((idx, idx + _MAX_BDAY_GAP)))
+    is_bday = _bday_bits(lo, hi)
+    
+    # 各位置以降で最初に営業日となる位置 (後ろから最小値を累積する)
+    n = len(is_bday)
+    pos = np.where(is_bday, np.arange(n), n)
+    next_pos = np.minimum.accumulate(pos[::-1])[::-1]
+    res = next_pos[idx - lo]
+    if (res >= n).any():
+        # _MAX_BDAY_GAP日先までに営業日がない日付があるときは、呼び出し元で1日ずつ求める
+        return None
+    return (res + lo + (_BDAY_FIRST_ORDINAL - _EPOCH_ORDINAL)).astype('datetime64[D]')
+
+def _settlement_date_array(days):
+    """
+    datetime64[D]の配列の各日付を約定日としたときの受渡日を返す。
+    ビットマップの範囲を超えるときはNoneを返す。
+    """
+    # 2019年7月16日より前は4営業日目、以降は3営業日目が受渡日
+    delta = np.where(days < np.datetime64(_SETTLEMENT_T2_START), 3, 2)
+    idx = days.astype(np.int64) - (_BDAY_FIRST_ORDINAL - _EPOCH_ORDINAL)
+    if len(idx) == 0:
+        return days
+    lo = int(idx.min())
+    hi = int(idx.max()) + 1 + 3 * _MAX_BDAY_GAP
+    if lo < 0 or _BDAY_END_ORDINAL - _BDAY_FIRST_ORDINAL < hi:
+        return None
+    
+    _ensure_bday_years_of(np.concatenate((idx, idx + 3 * _MAX_BDAY_GAP)))
+    
+    # 範囲内の営業日の位置を並べ、各日付より後の営業日をdelta個目まで進める
+    bday_idx = np.flatnonzero(_bday_bits(lo, hi)) + lo
+    res = bday_idx[np.searchsorted(bday_idx, idx, side='right') + delta - 1]
+    return (res + (_BDAY_FIRST_ORDINAL - _EPOCH_ORDINAL)).astype('datetime64[D]')
+
+def _scan_bday_idx(bitmap, idx, step):
+    """
+    ビットマップ上で、idxからstep(1または-1)の向きに進んで最初の営業日のインデックスを返す。
+    ビットマップの端まで見つからなければ-1を返す。
+    """
+    n_words = len(bitmap)
+    if not (0 <= idx < n_words * 64):
+        return -1
+    wi = idx >> 6
+    bit = idx & 63
+    if step > 0:
+        # idx以降のビットのうち最下位の立っているビットを探す
+        word = int(bitmap[wi]) >> bit
+        if word:
+            return idx + (word & -word).bit_length() - 1
+        for wi in range(wi + 1, n_words):
+            word = int(bitmap[wi])
+            if word:
+                return (wi << 6) + (word & -word).bit_length() - 1
+    else:
+        # idx以前のビットのうち最上位の立っているビットを探す
+        word = int(bitmap[wi]) & ((1 << (bit + 1)) - 1)
+        if word:
+            return (wi << 6) + word.bit_length() - 1
+        for wi in range(wi - 1, -1, -1):
+            word = int(bitmap[wi])
+            if word:
+                return (wi << 6) + word.bit_length() - 1
+    return -1
+
+if _HAS_NUMBA:
+    # numbaが使えるときは、走査のループをコンパイルする
+    
+    @njit(cache=True)
+    def _scan_bday_idx(bitmap, idx, step):
+        n = len(bitmap) * 64
+        while 0 <= idx < n:
+            if (bitmap[idx >> 6] >> np.uint64(idx & 63)) & np.uint64(1):
+                return idx
+            idx += step
+        return -1
+
+def _step_business_day(date, step):
+    """
+    date以降(step=1)またはdate以前(step=-1)で最も近い営業日を返す。
+    dateが営業日ならdateを返す。
+    """
+    idx = date.toordinal() - _BDAY_FIRST_ORDINAL
+    if 0 <= idx < _BDAY_END_ORDINAL - _BDAY_FIRST_ORDINAL:
+        # 営業日が途切れるのは長くても数日なので、隣の年まで祝日を反映しておけば足りる
+        for year in (date.year, date.year + step):
+            if year in _HOLIDAY_YEARS:
+                _ensure_bday_year(year)
+        found = _scan_bday_idx(_bday_bitmap, idx, step)
+        if found >= 0:
+            return datetime.date.fromordinal(found + _BDAY_FIRST_ORDINAL)
+    
+    # ビットマップの範囲外のときは、年ごとの表を探す
+    year = date.year
+    pos = date.toordinal() - datetime.date(year, 1, 1).toordinal()
+    while True:
+        table = _year_bday_bytes(year)
+        if step > 0:
+            found = table.find(b'\x01', pos)
+        else:
+            found = table.rfind(b'\x01', 0, pos + 1)
+        if found >= 0:
+            return datetime.date.fromordinal(datetime.date(year, 1, 1).toordinal() + found)
+        year += step
+        pos = 0 if step > 0 else len(_year_bday_bytes(year)) - 1
+
+def _ensure_bday_word(wi):
+    """ビットマップのwi番目の要素に含まれる日付の年の祝日を反映する"""
+    first = _BDAY_FIRST_ORDINAL + (wi << 6)
+    last = min(first + 63, _BDAY_END_ORDINAL - 1)
+    for year in {datetime.date.fromordinal(first).year, datetime.date.fromordinal(last).year}:
+        _ensure_bday_year(year)
+
+def _add_business_days(date, n):
+    """
+    dateのn営業日後(nが負のときは-n営業日前)の日付を返す。
+    ビットマップを64日ずつ読み、各要素の立っているビットの数だけ残りの日数を減らす。
+    """
+    if n == 0:
+        return date
+    step = 1 if n > 0 else -1
+    k = abs(n)
+    
+    # dateの翌日(または前日)から数える
+    idx = date.toordinal() - _BDAY_FIRST_ORDINAL + step
+    if 0 <= idx < _BDAY_END_ORDINAL - _BDAY_FIRST_ORDINAL:
+        wi = idx >> 6
+        if step > 0:
+            mask = ~0 << (idx & 63)
+        else:
+            mask = (1 << ((idx & 63) + 1)) - 1
+        while 0 <= wi < _BDAY_N_WORDS:
+            _ensure_bday_word(wi)
+            word = int(_bday_bitmap[wi]) & mask
+            count = bin(word).count('1')
+            if count >= k:
+                # この要素の中で、k番目に立っているビットを探す
+                if step > 0:
+                    for i in range(k - 1):
+                        word &= word - 1 # 最下位のビットを落とす
+                    bit = (word & -word).bit_length() - 1
+                else:
+                    for i in range(k - 1):
+                        word ^= 1 << (word.bit_length() - 1) # 最上位のビットを落とす
+                    bit = word.bit_length() - 1
+                return datetime.date.fromordinal(_BDAY_FIRST_ORDINAL + (wi << 6) + bit)
+            k -= count
+            wi += step
+            mask = ~0
+    
+    # ビットマップの範囲外にかかるときは1営業日ずつ進める
+    one_day = _ONE_DAY if step > 0 else -_ONE_DAY
+    for i in range(abs(n)):
+        date = _step_business_day(date + one_day, step)
+    return date
+
+# 受渡日の計算で、この日より前は4営業日目、以降は3営業日目を受渡日とする
+_SETTLEMENT_T2_START = datetime.date(2019, 7, 16)
+
+@lru_cache(maxsize=None)
+def _settlement_ordinals(year):
+    """
+    指定年の各日を約定日としたときの受渡日を、序数(date.toordinal())の配列で返す。
+    ビットマップの範囲を超えるときはNoneを返す。
+    """
+    days = np.arange(np.datetime64(f'{year}-01-01'), np.datetime64(f'{year + 1}-01-01'))
+    after2 = days
+    for i in range(2):
+        after2 = _next_business_day_array(after2, include_now=False)
+        if after2 is None:
+            return None
+    after3 = _next_business_day_array(after2, include_now=False)
+    if after3 is None:
+        return None
+    res = np.where(days < np.datetime64(_SETTLEMENT_T2_START), after3, after2)
+    return res.astype(np.int64) + _EPOCH_ORDINAL
+
+@lru_cache(maxsize=64)
+def _year_bday_bytes(year):
+    """
+    ビットマップの範囲外の年について、各日が営業日なら1、そうでなければ0のバイト列を返す。
+    バイト列のi番目が、その年のi+1日目に対応する。
+    """
+    is_bday = _is_weekday_not_year_end(_year_days(year, year + 1))
+    first_ordinal = datetime.date(year, 1, 1).toordinal()
+    for ordinal in _year_holiday_ordinals(year):
+        is_bday[ordinal - first_ordinal] = False
+    return is_bday.astype(np.uint8).tobytes()
+
+
+@lru_cache(maxsize=8)
+def _session_times(date, TIMEZONE):
+    """
+    指定日の取引時間の境界を求める。
+    判定はエポックからのナノ秒(int)同士の比較で行うので、境界もintで返す。
+
+    Returns
+    -------
+    is_after_arrowhead4 : bool
+        取引時間延長後か
+    zenba_first_ns, zenba_last_ns, goba_first_ns, goba_last_ns, five_minutes_before_goba_last_ns : int
+        各境界のエポックからのナノ秒
+    """
+    # 各時刻はその日の0時からのずれとして求める
+    midnight_ns = _local_midnight_ns(date, TIMEZONE)
+    zenba_first_ns = midnight_ns + (9 * 60) * _NS_PER_MINUTE
+    zenba_last_ns = midnight_ns + (11 * 60 + 30) * _NS_PER_MINUTE
+    goba_first_ns = midnight_ns + (12 * 60 + 30) * _NS_PER_MINUTE
+    if date >= datetime.date(year=2024, month=11, day=5):
+        # 取引時間延長後のとき
+        is_after_arrowhead4 = True
+        goba_last_ns = midnight_ns + (15 * 60 + 30) * _NS_PER_MINUTE
+        five_minutes_before_goba_last_ns = midnight_ns + (15 * 60 + 25) * _NS_PER_MINUTE # クロージング・オークション開始
+    else:
+        # 取引時間延長前のとき
+        is_after_arrowhead4 = False
+        goba_last_ns = midnight_ns + (15 * 60) * _NS_PER_MINUTE
+        five_minutes_before_goba_last_ns = midnight_ns + (14 * 60 + 55) * _NS_PER_MINUTE # 引け5分前(※ザラ場)
+    return (
+        is_after_arrowhead4, 
+        zenba_first_ns, zenba_last_ns, goba_first_ns, goba_last_ns, five_minutes_before_goba_last_ns,
+    )
+
+@lru_cache(maxsize=8)
+def _session_timestamps(date, TIMEZONE):
+    """指定日の取引時間の境界をpd.Timestampで返す"""
+    tz = _get_tzinfo(TIMEZONE)
+    return tuple(pd.Timestamp(ns, tz=tz) for ns in _session_times(date, TIMEZONE)[1:])
+
+
+class MarketState(IntEnum):
+    """
+    取引時間に対する状態。
+    各境界の扱いは、is_before_start等の判定のデフォルトの設定に合わせる。
+    """
+    CLOSED = 0 # 営業日でない
+    BEFORE_START = 1 # 前場の前
+    ZENBA = 2 # 前場 (両端を含む)
+    LUNCH_BREAK = 3 # 昼休み
+    GOBA = 4 # 後場 (両端を含む)
+    AFTER_END = 5 # 後場の後
+
+
+# 境界のうちいくつを過ぎたかに対応する状態
+_MARKET_STATES = (
+    MarketState.BEFORE_START, MarketState.ZENBA, MarketState.LUNCH_BREAK, 
+    MarketState.GOBA, MarketState.AFTER_END,
+)
+
+
+class _TradeTime:
+    """指定日の取引時間を扱うクラス。_to_date, _TIMEZONE, _nowはcreate_trade_time_objで設定される"""
+    # 設定済みの日付の序数(date.toordinal())。未設定のときはNone
+    _date_ordinal = None
+    
+    def __init__(self, date=None):
+        self.set_time_of_quotes(date=date)
+
+    def set_time_of_quotes(self, date):
+        if date is None:
+            date = self._now().date()
+        elif type(date) is not datetime.date:
+            date = self._to_date(date)
+
+        ordinal = date.toordinal()
+        if self._date_ordinal != ordinal:
+            # この関数を初めて呼び出すか、
+            # 前回呼び出した時から日付が変わっていた時
+            (
+                self.is_after_arrowhead4, 
+                self._zenba_first_ns, 
+                self._zenba_last_ns, 
+                self._goba_first_ns, 
+                self._goba_last_ns, 
+                self._five_minutes_before_goba_last_ns,
+            ) = _session_times(date, self._TIMEZONE)
+            self.is_business_day = _is_business_day(date)
+            
+            # market_stateで使う境界 (前場・後場は終わりの時刻を含むので、その1ns後を境界とする)
+            self._state_bounds = (
+                self._zenba_first_ns, self._zenba_last_ns + 1, 
+                self._goba_first_ns, self._goba_last_ns + 1,
+            )
+
+            self.date = date
+            self._date_ordinal = ordinal
+
+    # 境界のpd.Timestampは判定には使わないので、参照されたときに作る
+    @property
+    def zenba_first(self):
+        return _session_timestamps(self.date, self._TIMEZONE)[0]
+
+    @property
+    def zenba_last(self):
+        return _session_timestamps(self.date, self._TIMEZONE)[1]
+
+    @property
+    def goba_first(self):
+        return _session_timestamps(self.date, self._TIMEZONE)[2]
+
+    @property
+    def goba_last(self):
+        return _session_timestamps(self.date, self._TIMEZONE)[3]
+
+    @property
+    def five_minutes_before_goba_last(self):
+        return _session_timestamps(self.date, self._TIMEZONE)[4]
+
+    def _time_to_ns(self, time):
+        return _timestamp_to_ns(self._now() if time is None else time, self._TIMEZONE)
+
+    # 以下の_*_nsは、営業日であることを確認した後に、エポックからのナノ秒(int)で判定する
+    def _is_lunch_break_ns(self, t, inclusive):
+        if inclusive:
+            return (self._zenba_last_ns <= t <= self._goba_first_ns)
+        else:
+            return (self._zenba_last_ns < t < self._goba_first_ns)
+
+    def _is_before_start_ns(self, t, inclusive):
+        if inclusive:
+            return (t <= self._zenba_first_ns)
+        else:
+            return (t < self._zenba_first_ns)
+
+    def _is_after_end_ns(self, t, inclusive):
+        if inclusive:
+            return (self._goba_last_ns <= t)
+        else:
+            return (self._goba_last_ns < t)
+
+    def _is_trading_hours_ns(self, t, inclusive):
+        if inclusive:
+            return (self._zenba_first_ns <= t <= self._zenba_last_ns) or (self._goba_first_ns <= t <= self._goba_last_ns)
+        else:
+            return (self._zenba_first_ns < t < self._zenba_last_ns) or (self._goba_first_ns < t < self._goba_last_ns)
+
+    def _is_last_five_minutes_ns(self, t, inclusive):
+        if inclusive:
+            return (self._five_minutes_before_goba_last_ns <= t <= self._goba_last_ns)
+        else:
+            return (self._five_minutes_before_goba_last_ns < t < self._goba_last_ns)
+
+    def _market_state_ns(self, t):
+        return _MARKET_STATES[bisect_right(self._state_bounds, t)]
+
+    def is_lunch_break(self, time=None, inclusive=False):
+        if not self.is_business_day: return False
+        return self._is_lunch_break_ns(self._time_to_ns(time), inclusive)
+
+    def is_before_start(self, time=None, inclusive=False):
+        if not self.is_business_day: return False
+        return self._is_before_start_ns(self._time_to_ns(time), inclusive)
+
+    def is_after_end(self, time=None, inclusive=False):
+        if not self.is_business_day: return False
+        return self._is_after_end_ns(self._time_to_ns(time), inclusive)
+
+    def is_trading_hours(self, time=None, inclusive=True):
+        if not self.is_business_day: return False
+        return self._is_trading_hours_ns(self._time_to_ns(time), inclusive)
+
+    def is_last_five_minutes(self, time=None, inclusive=True):
+        if not self.is_business_day: return False
+        return self._is_last_five_minutes_ns(self._time_to_ns(time), inclusive)
+
+    def is_closing_auction(self, time=None, inclusive=True):
+        if self.is_business_day and self.is_after_arrowhead4:
+            return self.is_last_five_minutes(time=time, inclusive=inclusive)
+        else:
+            return False
+
+    def market_state(self, time=None):
+        """
+        取引時間に対する状態を一度の判定で返す。
+        複数のis_*を続けて呼ぶ代わりに使う。
+
+        Returns
+        -------
+        res : MarketState
+        """
+        if not self.is_business_day: return MarketState.CLOSED
+        return self._market_state_ns(self._time_to_ns(time))
+
+
+def _between_array(lower, t, upper, inclusive):
+    """配列の各要素について、lower < t < upper (inclusiveのときはlower <= t <= upper)か判定する"""
+    if inclusive:
+        return (lower <= t) & (t <= upper)
+    else:
+        return (lower < t) & (t < upper)
+
+def _classify_trading_hours_i8(t_ns, day_idx, is_business_day, zenba_first, zenba_last, goba_first, goba_last, inclusive):
+    """
+    各時刻が取引時間中か判定する。
+    day_idx以外の引数のうち日付ごとの表は、day_idxの値で引く。
+    """
+    res = _between_array(zenba_first[day_idx], t_ns, zenba_last[day_idx], inclusive) \
+        | _between_array(goba_first[day_idx], t_ns, goba_last[day_idx], inclusive)
+    return res & is_business_day[day_idx]
+
+if _HAS_NUMBA:
+    # numbaが使えるときは、表を引きながら1回の走査で判定する
+    
+    @njit(cache=True, parallel=True)
+    def _classify_trading_hours_i8(t_ns, day_idx, is_business_day, zenba_first, zenba_last, goba_first, goba_last, inclusive):
+        res = np.zeros(len(t_ns), np.bool_)
+        for i in prange(len(t_ns)):
+            d = day_idx[i]
+            if not is_business_day[d]:
+                continue
+            t = t_ns[i]
+            if inclusive:
+                res[i] = (zenba_first[d] <= t <= zenba_last[d]) or (goba_first[d] <= t <= goba_last[d])
+            else:
+                res[i] = (zenba_first[d] < t < zenba_last[d]) or (goba_first[d] < t < goba_last[d])
+        return res
+
+
+class _TradeTimeBase:
+    """日本株の取引時間を扱うクラス。_to_date, _TIMEZONE, _nowはcreate_trade_time_objで設定される"""
+    def __init__(self):
+        self._date2trade_time_obj = {}
+        # 直前に判定した日の(0時のナノ秒, 翌日0時のナノ秒, _TradeTimeオブジェクト)
+        self._last_day = (0, 0, None)
+
+    def __getitem__(self, value):
+        # デフォルトは現在時刻
+        if value is None:
+            value = self._now()
+
+        # 指定日の_TradeTimeオブジェクトを未作成なら作る
+        date = self._to_date(value)
+        if date not in self._date2trade_time_obj:
+            self._date2trade_time_obj[date] = self._trade_time_cls(date)
+
+        # 指定日の_TradeTimeオブジェクトを返す
+        return self._date2trade_time_obj[date]
+
+    def zenba_first(self, date=None):
+        return self[date].zenba_first
+
+    def zenba_last(self, date=None):
+        return self[date].zenba_last
+
+    def goba_first(self, date=None):
+        return self[date].goba_first
+
+    def goba_last(self, date=None):
+        return self[date].goba_last
+
+    def _resolve_time(self, time):
+        """
+        時刻をエポックからのナノ秒(int)にし、その時刻の(取引所のタイムゾーンでの)日付の
+        _TradeTimeオブジェクトと組にして返す。
+        日付は配列の判定(_gather_day_tables)と同じく_local_daysで決める。
+        """
+        t_ns = _timestamp_to_ns(self._now() if time is None else time, self._TIMEZONE)
+        day_start, day_end, obj = self._last_day
+        if day_start <= t_ns < day_end:
+            # 直前と同じ日なら、日付を求め直さない
+            return obj, t_ns
+        days = _local_days(t_ns, self._TIMEZONE)
+        date = datetime.date.fromordinal(days + _EPOCH_ORDINAL)
+        obj = self[date]
+        day_start = _local_midnight_ns(date, self._TIMEZONE)
+        day_end = _local_midnight_ns(next_day(date), self._TIMEZONE)
+        # 0時付近で夏時間が切り替わる日は_local_midnight_nsが正確でないので、両端の日付を確かめてから覚える
+        if _local_days(day_start, self._TIMEZONE) == days == _local_days(day_end - 1, self._TIMEZONE):
+            self._last_day = (day_start, day_end, obj)
+        return obj, t_ns
+
+    def is_lunch_break(self, time=None, inclusive=False):
+        obj, t = self._resolve_time(time)
+        return obj.is_business_day and obj._is_lunch_break_ns(t, inclusive)
+
+    def is_before_start(self, time=None, inclusive=False):
+        obj, t = self._resolve_time(time)
+        return obj.is_business_day and obj._is_before_start_ns(t, inclusive)
+
+    def is_after_end(self, time=None, inclusive=False):
+        obj, t = self._resolve_time(time)
+        return obj.is_business_day and obj._is_after_end_ns(t, inclusive)
+
+    def is_trading_hours(self, time=None, inclusive=True):
+        obj, t = self._resolve_time(time)
+        return obj.is_business_day and obj._is_trading_hours_ns(t, inclusive)
+
+    def is_last_five_minutes(self, time=None, inclusive=True):
+        obj, t = self._resolve_time(time)
+        return obj.is_business_day and obj._is_last_five_minutes_ns(t, inclusive)
+
+    def is_closing_auction(self, time=None, inclusive=True):
+        obj, t = self._resolve_time(time)
+        return obj.is_business_day and obj.is_after_arrowhead4 and obj._is_last_five_minutes_ns(t, inclusive)
+
+    def market_state(self, time=None):
+        obj, t = self._resolve_time(time)
+        if not obj.is_business_day: return MarketState.CLOSED
+        return obj._market_state_ns(t)
+
+    @classmethod
+    def _to_local_days(cls, times):
+        """
+        複数の時刻を、それぞれの(取引所のタイムゾーンでの)日付に変換する。
+
+        Parameters
+        ----------
+        times : array-like of datetime-like
+            np.ndarray of datetime64, pd.DatetimeIndex, 時刻のリストなど
+
+        Returns
+        -------
+        days : np.ndarray of datetime64[D]
+        """
+        local = pd.DatetimeIndex(times)
+        if local.tz is not None:
+            if cls._TIMEZONE is not None:
+                local = local.tz_convert(cls._TIMEZONE)
+            local = local.tz_localize(None)
+        return local.values.astype('datetime64[D]')
+
+    def _gather_day_tables(self, times):
+        """
+        複数の時刻について、日付ごとの取引時間の境界の表を作る。
+
+        Parameters
+        ----------
+        times : array-like of datetime-like
+            np.ndarray of datetime64, pd.DatetimeIndex, 時刻のリストなど
+            タイムゾーンを持たない時刻は、要素がnumpy.datetime64ならUTC、
+            それ以外ならTIMEZONEの時刻とみなす(_timestamps_to_ns参照)
+
+        Returns
+        -------
+        t_ns : np.ndarray of int64
+            各時刻のエポックからのナノ秒
+        day_idx : np.ndarray of int64
+            各時刻の日付が、表の何番目の日付か
+        tables : dict of np.ndarray
+            日付ごとの境界(エポックからのナノ秒)と、is_business_day, is_after_arrowhead4の値
+        """
+        t_ns = _timestamps_to_ns(times, self._TIMEZONE)
+        # スカラーの判定(_resolve_time)と同じく、取引所のタイムゾーンでの日付を使う
+        days = _local_days(t_ns, self._TIMEZONE)
+        
+        if len(days) and days.max() - days.min() < len(days):
+            # 日付の範囲が時刻の数より狭いときは、範囲内の全ての日付の表を作ってソートを省く
+            table_days = np.arange(days.min(), days.max() + 1)
+            day_idx = days - table_days[0]
+        else:
+            # 日付ごとに一度だけ境界を求め、各時刻に割り当てる
+            table_days, day_idx = np.unique(days, return_inverse=True)
+            day_idx = day_idx.reshape(-1).astype(np.int64)
+        
+        trade_time_objs = [self[date] for date in table_days.astype('datetime64[D]').tolist()]
+        tables = {
+            name: np.array([getattr(obj, name) for obj in trade_time_objs], dtype=np.int64)
+            for name in (
+                '_zenba_first_ns', '_zenba_last_ns', '_goba_first_ns', '_goba_last_ns',
+                '_five_minutes_before_goba_last_ns',
+            )
+        }
+        for name in ('is_business_day', 'is_after_arrowhead4'):
+            tables[name] = np.array([getattr(obj, name) for obj in trade_time_objs], dtype=bool)
+        return t_ns, day_idx, tables
+
+    def _gather_boundaries(self, times):
+        """
+        複数の時刻について、それぞれの日付の取引時間の境界を集める。
+
+        Parameters
+        ----------
+        times : array-like of datetime-like
+            np.ndarray of datetime64, pd.DatetimeIndex, 時刻のリストなど
+
+        Returns
+        -------
+        t_ns : np.ndarray of int64
+            各時刻のエポックからのナノ秒
+        bounds : dict of np.ndarray
+            各時刻の日付における境界(エポックからのナノ秒)と、
+            is_business_day, is_after_arrowhead4の値
+        is_business_day : np.ndarray of bool
+            各時刻の日付が営業日か
+        """
+        t_ns, day_idx, tables = self._gather_day_tables(times)
+        bounds = {name: table[day_idx] for name, table in tables.items()}
+        return t_ns, bounds, bounds['is_business_day']
+
+    def is_trading_hours_many(self, times, inclusive=True):
+        """
+        複数の時刻について、取引時間中か判定する。
+
+        Parameters
+        ----------
+        times : array-like of datetime-like
+            np.ndarray of datetime64, pd.DatetimeIndex, 時刻のリストなど
+        inclusive : bool, default: True
+            境界の時刻を含めるか
+
+        Returns
+        -------
+        res : np.ndarray of bool
+            各時刻が取引時間中か
+        """
+        t_ns, day_idx, tab = self._gather_day_tables(times)
+        return _classify_trading_hours_i8(
+            t_ns, day_idx, tab['is_business_day'], 
+            tab['_zenba_first_ns'], tab['_zenba_last_ns'], tab['_goba_first_ns'], tab['_goba_last_ns'], 
+            inclusive,
+        )
+
+    def is_lunch_break_many(self, times, inclusive=False):
+        """複数の時刻について、昼休みか判定する。引数と返り値はis_trading_hours_manyと同じ"""
+        t, b, is_business_day = self._gather_boundaries(times)
+        return _between_array(b['_zenba_last_ns'], t, b['_goba_first_ns'], inclusive) & is_business_day
+
+    def is_before_start_many(self, times, inclusive=False):
+        """複数の時刻について、前場の前か判定する。引数と返り値はis_trading_hours_manyと同じ"""
+        t, b, is_business_day = self._gather_boundaries(times)
+        res = (t <= b['_zenba_first_ns']) if inclusive else (t < b['_zenba_first_ns'])
+        return res & is_business_day
+
+    def is_after_end_many(self, times, inclusive=False):
+        """複数の時刻について、後場の後か判定する。引数と返り値はis_trading_hours_manyと同じ"""
+        t, b, is_business_day = self._gather_boundaries(times)
+        res = (b['_goba_last_ns'] <= t) if inclusive else (b['_goba_last_ns'] < t)
+        return res & is_business_day
+
+    def is_last_five_minutes_many(self, times, inclusive=True):
+        """複数の時刻について、後場の最後の5分間か判定する。引数と返り値はis_trading_hours_manyと同じ"""
+        t, b, is_business_day = self._gather_boundaries(times)
+        res = _between_array(b['_five_minutes_before_goba_last_ns'], t, b['_goba_last_ns'], inclusive)
+        return res & is_business_day
+
+    def is_closing_auction_many(self, times, inclusive=True):
+        """複数の時刻について、クロージング・オークションか判定する。引数と返り値はis_trading_hours_manyと同じ"""
+        t, b, is_business_day = self._gather_boundaries(times)
+        res = _between_array(b['_five_minutes_before_goba_last_ns'], t, b['_goba_last_ns'], inclusive)
+        return res & is_business_day & b['is_after_arrowhead4']
+
+    def market_state_many(self, times):
+        """
+        複数の時刻について、取引時間に対する状態を返す。
+
+        Parameters
+        ----------
+        times : array-like of datetime-like
+            np.ndarray of datetime64, pd.DatetimeIndex, 時刻のリストなど
+
+        Returns
+        -------
+        res : np.ndarray of int8
+            各時刻のMarketStateの値
+        """
+        t, b, is_business_day = self._gather_boundaries(times)
+        # market_stateと同じく、過ぎた境界の数から状態を決める
+        n_passed = (
+            (b['_zenba_first_ns'] <= t).astype(np.int8)
+            + (b['_zenba_last_ns'] < t)
+            + (b['_goba_first_ns'] <= t)
+            + (b['_goba_last_ns'] < t)
+        )
+        return np.where(is_business_day, n_passed + MarketState.BEFORE_START, MarketState.CLOSED).astype(np.int8)
+
+    @classmethod
+    def settlement_date(cls, trade_date):
+        """約定日から受渡日を計算する"""
+        trade_date = cls._to_date(trade_date)
+        if trade_date.year in _HOLIDAY_YEARS:
+            # 年ごとに求めておいた表から引く
+            table = _settlement_ordinals(trade_date.year)
+            if table is not None:
+                day_of_year = trade_date.toordinal() - datetime.date(trade_date.year, 1, 1).toordinal()
+                return datetime.date.fromordinal(int(table[day_of_year]))
+
+        if trade_date < _SETTLEMENT_T2_START:
+            delta = 3 # 2019年7月16日より前は4営業日目が受渡日
+        else:
+            delta = 2 # 2019年7月16日以降は3営業日目が受渡日
+
+        return _add_business_days(trade_date, delta)
+
+    @classmethod
+    def settlement_date_many(cls, times):
+        """
+        複数の約定日について、受渡日を計算する
+
+        Parameters
+        ----------
+        times : array-like of datetime-like
+            np.ndarray of datetime64, pd.DatetimeIndex, 日付のリストなど
+
+        Returns
+        -------
+        res : np.ndarray of datetime64[D]
+            各約定日の受渡日
+        """
+        days = cls._to_local_days(times)
+        res = _settlement_date_array(days)
+        if res is None:
+            # ビットマップの範囲外を含むときは1日ずつ求める
+            res = np.array([cls.settlement_date(d) for d in days.tolist()], dtype='datetime64[D]')
+        return res
+
+    @classmethod
+    def add_business_days(cls, time_obj, n):
+        """
+        銀行カレンダーにおけるn営業日後の日付を返す。
+
+        Parameters
+        ----------
+        time_obj : datetime-like object
+            datetime.datetime, datetime.date, numpy.datetime64, pd.Timestamp, str型など
+            str型の場合はpd.Timestampを通して変換する
+
+        n : int
+            進める営業日の数。負のときは前の営業日に戻る。
+
+        Returns
+        -------
+        res : datetime.date object
+            n営業日後の日付。n=0のときは入力の日付をそのまま返す。
+        """
+        return _add_business_days(cls._to_date(time_obj), n)
+
+    @classmethod
+    def is_business_day(cls, time_obj):
+        """
+        銀行カレンダーにおいて営業日か判定する
+
+        Parameters
+        ----------
+        time_obj : datetime-like object
+            datetime.datetime, datetime.date, numpy.datetime64, pd.Timestamp, str型など
+            str型の場合はpd.Timestampを通して変換する
+
+        Returns
+        -------
+        res : boolean
+            営業日か。土日祝または12/31 ~ 01/03 ならばFalse、それ以外ならTrue
+        """
+        # datetime.date型に変換する
+        date = cls._to_date(time_obj)
+        return _is_business_day(date)
+
+    @classmethod
+    def is_business_day_many(cls, times):
+        """
+        複数の日付について、銀行カレンダーにおいて営業日か判定する
+
+        Parameters
+        ----------
+        times : array-like of datetime-like
+            np.ndarray of datetime64, pd.DatetimeIndex, 日付のリストなど
+
+        Returns
+        -------
+        res : np.ndarray of bool
+            各日付が営業日か
+        """
+        return _is_business_day_array(cls._to_local_days(times))
+
+    @classmethod
+    def next_business_day_many(cls, times, include_now=False):
+        """
+        複数の日付について、銀行カレンダーにおける次の営業日を返す
+
+        Parameters
+        ----------
+        times : array-like of datetime-like
+            np.ndarray of datetime64, pd.DatetimeIndex, 日付のリストなど
+
+        include_now : bool, default: False
+            if True, 入力が営業日ならそのまま返す。
+            if False, 翌日以降で最も近い営業日を返す
+
+        Returns
+        -------
+        res : np.ndarray of datetime64[D]
+            各日付の次の営業日
+        """
+        days = cls._to_local_days(times)
+        res = _next_business_day_array(days, include_now)
+        if res is None:
+            # ビットマップの範囲外を含むときは1日ずつ求める
+            # daysの要素はすでにdatetime.dateなので、_to_dateを通さずに探す
+            start_days = days.tolist() if include_now else [next_day(d) for d in days.tolist()]
+            res = np.array(
+                [_step_business_day(d, 1) for d in start_days], 
+                dtype='datetime64[D]',
+            )
+        return res
+
+    @classmethod
+    def count_business_days(cls, start, end):
+        """
+        銀行カレンダーにおいて[start, end)に含まれる営業日の数を返す
+
+        Parameters
+        ----------
+        start, end : datetime-like object
+            datetime.datetime, datetime.date, numpy.datetime64, pd.Timestamp, str型など
+            str型の場合はpd.Timestampを通して変換する
+
+        Returns
+        -------
+        res : int
+            startの日付以降、endの日付より前の営業日の数
+        """
+        return _count_business_days(cls._to_date(start), cls._to_date(end))
+
+    @classmethod
+    def next_business_day(cls, time_obj, include_now=False):
+        """
+        銀行カレンダーにおける次の営業日を返す。
+
+        Parameters
+        ----------
+        time_obj : datetime-like object
+            datetime.datetime, datetime.date, numpy.datetime64, pd.Timestamp, str型など
+            str型の場合はpd.Timestampを通して変換する
+
+        include_now : bool, default: False
+            if True, 入力が営業日ならそのまま返す。
+            if False, 前日以降で最も近い営業日を返す
+
+        Returns
+        -------
+        res : datetime.date object
+            次の営業日。
+        """
+        date = cls._to_date(time_obj)
+        if not include_now:
+            date = next_day(date)
+        return _step_business_day(date, 1)
+
+    @classmethod
+    def previous_business_day(cls, time_obj, include_now=False):
+        """
+        銀行カレンダーにおける前の営業日を返す。
+
+        Parameters
+        ----------
+        time_obj : datetime-like object
+            datetime.datetime, datetime.date, numpy.datetime64, pd.Timestamp, str型など
+            str型の場合はpd.Timestampを通して変換する
+
+        include_now : bool, default: False
+            if True, 入力が営業日ならそのまま返す。
+            if False, 前日以前で最も近い営業日を返す
+
+        Returns
+        -------
+        res : datetime.date object
+            前の営業日。
+        """
+        date = cls._to_date(time_obj)
+        if not include_now:
+            date = previous_day(date)
+        return _step_business_day(date, -1)
+
+@lru_cache(maxsize=None)
+def _create_trade_time_class(to_date, TIMEZONE, now):
+    """
+    to_date, TIMEZONE, nowを設定したTradeTimeクラスを作る。
+    同じ引数に対しては同じクラスを返す。
+    """
+    attrs = {
+        '_to_date': staticmethod(to_date),
+        '_TIMEZONE': TIMEZONE,
+        '_now': staticmethod(now),
+    }
+    trade_time_cls = type('_TradeTime', (_TradeTime,), attrs)
+    return type('TradeTime', (_TradeTimeBase,), {**attrs, '_trade_time_cls': trade_time_cls})
+
+def create_trade_time_obj(to_date, TIMEZONE, now):
+    return _create_trade_time_class(to_date, TIMEZONE, now)()
         
     
     
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import timemanager
+from timemanager import notz
+
+PREDICATES = [
+    'is_lunch_break', 'is_before_start', 'is_after_end', 'is_trading_hours',
+    'is_last_five_minutes', 'is_closing_auction', 'market_state',
+]
+
+# 日付の境界をまたぐ時刻と、取引時間延長の前後を含める
+TIMES = [np.datetime64('2024-01-04T00:00') + np.timedelta64(m, 'm') for m in range(-600, 3 * 1440, 17)] + [
+    np.datetime64('2024-01-04T23:30'),
+    np.datetime64('2024-11-06T01:00'),
+]
+
+CONTAINERS = {
+    'ndarray': np.array,
+    'list': list,
+    'DatetimeIndex': pd.DatetimeIndex,
+}
+
+
+@pytest.mark.parametrize('module', [timemanager, notz])
+@pytest.mark.parametrize('container', CONTAINERS)
+@pytest.mark.parametrize('name', PREDICATES)
+def test_many_agrees_with_scalar(module, container, name):
+    """*_manyの結果が、各要素をスカラーの判定に渡した結果と一致する"""
+    times = CONTAINERS[container](TIMES)
+    trade_time = module.trade_time
+    expected = [int(getattr(trade_time, name)(t)) for t in times]
+    assert getattr(trade_time, name + '_many')(times).astype(int).tolist() == expected
+
+
+def test_datetime64_is_utc():
+    """タイムゾーンを持たないnumpy.datetime64は、入れ物によらずUTCの時刻とみなす"""
+    t = np.datetime64('2024-11-06T01:00')  # 日本時間の10:00
+    trade_time = timemanager.trade_time
+    assert trade_time.is_trading_hours(t)
+    assert trade_time.is_trading_hours_many([t]).tolist() == [True]
+    assert trade_time.is_trading_hours_many(np.array([t])).tolist() == [True]